@@ -0,0 +1,73 @@
+import argparse
+import re
+from typing import List, Optional
+
+import pandas as pd
+
+from route_http import get_page, login, new_session, text_of
+from seat_solver import AIRCRAFT_DATA
+
+AIRCRAFT_COLUMNS = ["make", "model", "seats", "range", "speed", "price"]
+# Spec labels of an aircraft box on the buy page, each followed by its value
+SPEC_LABELS = {
+    "seats": r"Seats",
+    "range": r"Range",
+    "speed": r"Speed",
+    "price": r"Price",
+}
+
+
+def spec_value(text: str, label: str) -> Optional[int]:
+    match = re.search(rf"{label}\s*:?\s*\$?\s*([\d][\d,. ]*)", text, re.IGNORECASE)
+    if match:
+        return int(re.sub(r"[^\d]", "", match.group(1)))
+
+
+def parse_aircraft_list(page, make: str) -> List[dict]:
+    """One row per aircraft model listed on a maker's /aircraft/buy/new/ page."""
+    aircraft = []
+    for box in page.xpath('//div[@class="aircraftList"]/div'):
+        titles = box.find_class("title")
+        match = titles and re.search(rf"(.+?) / {re.escape(make)}", text_of(titles[0]), re.IGNORECASE)
+        if not match:
+            continue
+        text = text_of(box)
+        row = {"make": make, "model": match.group(1).strip()}
+        row.update({column: spec_value(text, label) for column, label in SPEC_LABELS.items()})
+        aircraft.append(row)
+    return aircraft
+
+
+def scrape_aircraft(makes: List[str], path: str = AIRCRAFT_DATA) -> pd.DataFrame:
+    """Builds the seat solver's aircraft table from the buy pages of every maker."""
+    session = new_session()
+    login(session)
+    rows = []
+    for make in makes:
+        found = parse_aircraft_list(get_page(session, f"/aircraft/buy/new/{make.lower()}"), make)
+        print(f"{make}: {len(found)} aircraft models")
+        rows += found
+    df = pd.DataFrame(rows, columns=AIRCRAFT_COLUMNS)
+    incomplete = df[df.isna().any(axis=1)]
+    if not incomplete.empty:
+        print(f"Skipping models with missing specs:\n{incomplete}")
+    df = df.dropna().astype({column: int for column in AIRCRAFT_COLUMNS[2:]})
+    df.to_csv(path, index=False)
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "makes",
+        help="Aircraft maker names as per Airline Tycoon (comma seperated) eg: Airbus,Boeing,Ilyushin",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        help=f"Aircraft table to write (Default: {AIRCRAFT_DATA})",
+        default=AIRCRAFT_DATA,
+    )
+    args = parser.parse_args()
+    df = scrape_aircraft(args.makes.split(","), args.output)
+    print(f"Saved {len(df)} aircraft models to {args.output}")
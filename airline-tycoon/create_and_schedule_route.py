@@ -1,12 +1,10 @@
 import argparse
 import os
 import sys
-import time
 import traceback
-from typing import Any, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import pandas as pd
-from retry import retry
 from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.common.by import By
@@ -14,14 +12,19 @@ from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.chrome.options import Options
 
+import wait
 from route import (
+    BrowserPool,
     extract_route_price_stats,
     find_hub_id,
     is_extracted,
     login,
+    run_in_browser_pool,
     select_route,
 )
 from seat import find_seat_config
+from seat_batch import load_seat_configs
+from seat_solver import solve_seat_config
 
 
 chrome_options = Options()
@@ -48,27 +51,26 @@ def get_aircraft_config(seat_config_df: pd.DataFrame, nth=2):
 
 
 def select_flight(driver: WebDriver, hub_id: int, aircraft_model: str):
-    time.sleep(1)
-    js_click(driver, driver.find_element(By.XPATH, f"//span[@data-hubid='{hub_id}']"))
-    time.sleep(2)
-    el = driver.find_element("id", "aircraftNameFilter")
+    js_click(driver, wait.clickable(driver, (By.XPATH, f"//span[@data-hubid='{hub_id}']")))
+    wait.network_idle(driver)
+    el = wait.clickable(driver, (By.ID, "aircraftNameFilter"))
     el.clear()
     el.send_keys(searchable_aircraft_model(aircraft_model))
-    time.sleep(2)
+    wait.network_idle(driver)
     js_click(
         driver,
-        driver.find_element(
-            By.CSS_SELECTOR, "input[type='radio'][value='utilizationPercentageAsc']"
+        wait.clickable(
+            driver,
+            (By.CSS_SELECTOR, "input[type='radio'][value='utilizationPercentageAsc']"),
         ),
     )
 
 
-@retry(NoSuchElementException, delay=1, tries=10, jitter=1)
 def select_route_for_aircraft(driver: WebDriver, hub: str, destination: str):
     js_click(
         driver,
-        driver.find_element(
-            By.XPATH, f"//span[contains(text(), '{hub} / {destination}')]"
+        wait.present(
+            driver, (By.XPATH, f"//span[contains(text(), '{hub} / {destination}')]")
         ),
     )
 
@@ -87,10 +89,14 @@ def assign_flights(
     assigned_aircrafts: int,
 ):
     print(f"Configuring with:\n{seat_config}")
-    print(
-        f"Excluding already configured {assigned_aircrafts}, scheduing {seat_config['no'] - assigned_aircrafts} flights"
-    )
-    for i in range(0, seat_config["no"] - assigned_aircrafts):
+    count = seat_config["no"] - assigned_aircrafts
+    print(f"Excluding already configured {assigned_aircrafts}, scheduing {count} flights")
+    if count <= 0:
+        return
+
+    scheduled = schedule_flights(driver, hub_id, hub, destination, aircraft_model, count)
+    # Whatever the single pass couldn't schedule goes through the page reload per flight
+    for i in range(scheduled, count):
         print(f"Scheduling flight {i+1}...")
         schedule_a_flight(driver, hub_id, hub, destination, aircraft_model)
 
@@ -103,6 +109,95 @@ def schedule_a_flight(driver: WebDriver, hub_id, hub, destination, aircraft_mode
     driver.get("http://tycoon.airlines-manager.com/network/planning")
     select_flight(driver, hub_id, aircraft_model)
     check_for_free_aircraft(driver, hub, aircraft_model)
+    plan_selected_aircraft(driver, hub, destination)
+
+
+def schedule_flights(
+    driver: WebDriver, hub_id, hub, destination, aircraft_model, count: int
+) -> int:
+    """
+    Schedules up to `count` free aircraft from a single load of the planning page:
+    one filter and sort, then each free aircraft is selected and planned in turn.
+    Returns how many were submitted, only failures before a submit stop it early.
+    """
+    driver.get("http://tycoon.airlines-manager.com/network/planning")
+    select_flight(driver, hub_id, aircraft_model)
+    wait.network_idle(driver)
+
+    scheduled, planned = 0, None
+    while scheduled < count:
+        try:
+            # Whether submitting re-renders the list over AJAX or reloads the page isn't known,
+            # so the filter is checked and the free aircraft are scanned again before each one
+            if not planning_filtered(driver, aircraft_model):
+                select_flight(driver, hub_id, aircraft_model)
+                wait.network_idle(driver)
+            free = free_aircraft(driver)
+            if not free:
+                print(f"No more free {aircraft_model} in HUB {hub}")
+                break
+            js_click(driver, free[0])
+            wait.network_idle(driver)
+            if planned is not None:
+                # Clicking an aircraft box isn't confirmed to move the selection, so the grid of
+                # the aircraft just submitted must be replaced before anything is planned again
+                wait.until(
+                    driver, lambda d: planning_area(d) != planned, "next aircraft selected"
+                )
+            fill_planning(driver, hub, destination)
+        except Exception as e:
+            print(f"Scheduling in one pass stopped after {scheduled} flights: {e}")
+            break
+
+        # Once submitted the flight may be planned, falling back could plan it twice
+        submit_planning(driver)
+        scheduled += 1
+        print(f"Scheduled flight {scheduled}")
+        try:
+            wait.until(
+                driver,
+                lambda d: not planning_filtered(d, aircraft_model)
+                or len(free_aircraft(d)) < len(free),
+                "planned aircraft no longer free",
+            )
+            wait.network_idle(driver)
+            planned = planning_area(driver)
+        except Exception as e:
+            print(f"Scheduling in one pass stopped after {scheduled} flights: {e}")
+            break
+    return scheduled
+
+
+def planning_area(driver: WebDriver) -> str:
+    return driver.find_element(By.XPATH, '//table[@class="planningArea"]').get_attribute(
+        "innerHTML"
+    )
+
+
+def planning_filtered(driver: WebDriver, aircraft_model: str) -> bool:
+    filters = driver.find_elements(By.ID, "aircraftNameFilter")
+    return bool(filters) and filters[0].get_attribute("value") == searchable_aircraft_model(
+        aircraft_model
+    )
+
+
+def free_aircraft(driver: WebDriver) -> List[WebElement]:
+    free = []
+    for aircraft in driver.find_elements(By.XPATH, "//*[@class='aircraftsBox']/div"):
+        try:
+            if aircraft.find_element(By.XPATH, "div[2]/span[1]/b").text == "0%":
+                free.append(aircraft)
+        except NoSuchElementException:
+            pass
+    return free
+
+
+def plan_selected_aircraft(driver: WebDriver, hub, destination):
+    fill_planning(driver, hub, destination)
+    submit_planning(driver)
+
+
+def fill_planning(driver: WebDriver, hub, destination):
     select_route_for_aircraft(driver, hub, destination)
 
     js_click(
@@ -117,11 +212,14 @@ def schedule_a_flight(driver: WebDriver, hub_id, hub, destination, aircraft_mode
             By.XPATH, '//div[@id="planning"]/table[1]/tbody/tr[2]/td[1]/img'
         ),
     )
+
+
+def submit_planning(driver: WebDriver):
     js_click(driver, driver.find_element("id", "planningSubmit"))
 
 
 def check_for_free_aircraft(driver: WebDriver, hub, aircraft_model):
-    time.sleep(1)
+    wait.network_idle(driver)
     try:
         use = driver.find_element(
             By.XPATH, "//*[@class='aircraftsBox']/div[1]/div[2]/span[1]/b"
@@ -138,6 +236,11 @@ def saved_seat_config_df(
     aircraft_maker: str,
     aircraft_model: str,
 ) -> pd.DataFrame:
+    # Configs precomputed by seat_batch.py for every route and aircraft model of the hub
+    df = load_seat_configs(hub, destination, aircraft_maker, aircraft_model)
+    if not df.empty:
+        return df
+
     if os.path.exists(
         seat_config_file(hub, destination, aircraft_maker, aircraft_model)
     ):
@@ -167,25 +270,88 @@ def seat_config_file(
     return f"tmp/seat/{hub}_{destination}_{aircraft_maker}_{aircraft_model}.csv"
 
 
-@retry(NoSuchElementException, delay=5, tries=6)
+def find_assigned_aircraft(
+    driver, hub: str, destination: str, models: List[Tuple[str, str]]
+) -> Dict[Optional[Tuple[str, str]], int]:
+    """Aircraft flying the route per (make, model) of `models`, any other model counts under None."""
+    try:
+        select_route(driver, f"{hub} - {destination}")
+    except NoSuchElementException:
+        # Routes that aren't opened yet are missing from the route picker
+        return {}
+    # Longest names first so a 737-800 isn't taken for a 737
+    by_length = sorted(models, key=lambda make_model: len(make_model[1]), reverse=True)
+    counts = {}
+    for aircraft in driver.find_elements(By.XPATH, '//div[@class="aircraftListView"]/div'):
+        text = aircraft.text.lower()
+        model = next(
+            (m for m in by_length if searchable_aircraft_model(m[1]).lower() in text), None
+        )
+        counts[model] = counts.get(model, 0) + 1
+    return counts
+
+
 def find_assigned_flight_count(driver, hub, destination):
     select_route(driver, f"{hub} - {destination}")
     return int(
-        driver.find_element(
-            By.XPATH, '//div[@id="showLine"]/div[3]/ul[1]/li[2]/strong'
+        wait.present(
+            driver, (By.XPATH, '//div[@id="showLine"]/div[3]/ul[1]/li[2]/strong')
         ).text
     )
 
 
-def clear_all_and_enter(inputs: List[Tuple[WebElement, Any]]):
+def clear_all_and_enter(driver: WebDriver, inputs: List[Tuple[WebElement, Any]]):
+    # Zero everything first so the page's free-space check never rejects an input,
+    # then wait for each value to settle before moving on to the next field
     for set in inputs:
         set[0].clear()
         set[0].send_keys("0")
-    time.sleep(2)
+    for set in inputs:
+        wait.value_equals(driver, set[0], "0")
     for set in inputs:
         set[0].clear()
         set[0].send_keys(str(set[1]))
-        time.sleep(2)
+        wait.value_equals(driver, set[0], str(set[1]))
+    wait.network_idle(driver)
+
+
+RECONFIGURE_INPUTS = {
+    "economy": "ecoManualInput",
+    "business": "busManualInput",
+    "first": "firstManualInput",
+    "cargo": "cargoManualInput",
+}
+
+
+def reconfigure_aircraft(
+    driver: WebDriver,
+    aircraft_link: str,
+    seat_config: pd.Series,
+    name: str,
+    name_prefix: str = None,
+) -> bool:
+    """
+    Reconfigures one aircraft, returns False without touching it if it's already at the target.
+    An aircraft whose name already starts with `name_prefix` keeps it instead of being renamed.
+    """
+    driver.get(aircraft_link + "/reconfigure")
+    name_input = driver.find_element("id", "aircraft_name")
+    current_name = name_input.get_attribute("value") or ""
+    if name_prefix and current_name.startswith(name_prefix):
+        name = current_name
+    inputs = [
+        (wait.present(driver, (By.ID, input_id)), int(seat_config[seat_class]))
+        for seat_class, input_id in RECONFIGURE_INPUTS.items()
+    ] + [(name_input, name)]
+    if all(el.get_attribute("value") == str(value) for el, value in inputs):
+        return False
+
+    clear_all_and_enter(driver, inputs)
+    driver.find_element(
+        By.XPATH, '//input[@value="Confirm the reconfiguration"]'
+    ).submit()
+    wait.network_idle(driver)
+    return True
 
 
 def reconfigure_flight_seats(
@@ -193,6 +359,7 @@ def reconfigure_flight_seats(
     hub: str,
     destination: str,
     seat_config: pd.Series,
+    workers: int = 1,
 ):
     select_route(driver, f"{hub} - {destination}")
     aircrafts = driver.find_elements(By.XPATH, '//div[@class="aircraftListView"]/div')
@@ -204,24 +371,101 @@ def reconfigure_flight_seats(
             )
         )
 
-    for i, aircraft_link in enumerate(aircraft_links):
+    changed, skipped = [], []
+
+    def reconfigure(worker: WebDriver, item: Tuple[int, str]):
+        i, aircraft_link = item
         print(f"Reconfiguring seat on Aircraft {i+1}")
-        driver.get(aircraft_link + "/reconfigure")
-        clear_all_and_enter(
-            [
-                (driver.find_element("id", "ecoManualInput"), seat_config["economy"]),
-                (driver.find_element("id", "busManualInput"), seat_config["business"]),
-                (driver.find_element("id", "firstManualInput"), seat_config["first"]),
-                (driver.find_element("id", "cargoManualInput"), seat_config["cargo"]),
-                (
-                    driver.find_element("id", "aircraft_name"),
-                    f"{hub}-{destination}-{i}",
-                ),
-            ]
+        # Positions in the list can change between runs, names already on the route are kept
+        name_prefix = f"{hub}-{destination}-"
+        if reconfigure_aircraft(worker, aircraft_link, seat_config, f"{name_prefix}{i}", name_prefix):
+            changed.append(item)
+        else:
+            skipped.append(item)
+
+    items = list(enumerate(aircraft_links))
+    if workers > 1:
+        failed = run_in_browser_pool(items, reconfigure, workers, chrome_options)
+    else:
+        failed = []
+        for item in items:
+            try:
+                reconfigure(driver, item)
+            except Exception:
+                traceback.print_exception(*sys.exc_info())
+                failed.append(item)
+
+    print(
+        f"Reconfigured {hub} - {destination}: {len(changed)} changed, "
+        f"{len(skipped)} already configured, {len(failed)} failed"
+    )
+    if failed:
+        print("Failed aircraft: " + ",".join(str(i + 1) for i, _ in sorted(failed)))
+
+
+def prepare_route(
+    driver: WebDriver,
+    hub: str,
+    destination: str,
+    aircraft_make: str,
+    aircraft_model: str,
+    solver: str,
+) -> pd.DataFrame:
+    """Read-only half of a route: extracts its stats if needed and finds its seat configs."""
+    print(f"Working on route {hub} - {destination}")
+    extract_route_price_stats(driver, hub, destination)
+
+    seat_config_df = saved_seat_config_df(hub, destination, aircraft_make, aircraft_model)
+    if seat_config_df.empty and solver == "native":
+        seat_config_df = solve_seat_config(
+            hub,
+            [destination],
+            aircraft_make,
+            aircraft_model,
+            no_negative=True,
         )
-        driver.find_element(
-            By.XPATH, '//input[@value="Confirm the reconfiguration"]'
-        ).submit()
+    elif seat_config_df.empty:
+        seat_config_df = find_seat_config(
+            driver,
+            hub,
+            [destination],
+            aircraft_make,
+            aircraft_model,
+            no_negative=True,
+        )
+        save_seat_config_df(
+            seat_config_df,
+            hub,
+            destination,
+            aircraft_make,
+            aircraft_model,
+        )
+    return seat_config_df
+
+
+def schedule_route(
+    driver: WebDriver,
+    hub_id: int,
+    hub: str,
+    destination: str,
+    seat_config: pd.Series,
+    aircraft_model: str,
+    workers: int = 1,
+):
+    """Game-state half of a route: assigns its flights and reconfigures their seats."""
+    print(f"Scheduling route {hub} - {destination}")
+    assigned_aircrafts = find_assigned_flight_count(driver, hub, destination)
+    assign_flights(
+        driver,
+        hub_id,
+        hub,
+        destination,
+        seat_config,
+        aircraft_model,
+        assigned_aircrafts,
+    )
+
+    reconfigure_flight_seats(driver, hub, destination, seat_config, workers)
 
 
 if __name__ == "__main__":
@@ -252,6 +496,26 @@ if __name__ == "__main__":
         help="Configure with the nth best seat config based on turnover (Default: 2)",
         default=2,
     )
+    parser.add_argument(
+        "--solver",
+        choices=["noway", "native"],
+        help="Compute seat configs on destinations.noway.info or with the local solver (Default: noway)",
+        default="noway",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        help="Number of logged-in browsers reconfiguring aircraft seats in parallel (Default: 1)",
+        default=1,
+    )
+    parser.add_argument(
+        "--pipeline",
+        "-p",
+        type=int,
+        help="Extract stats and compute seat configs of upcoming routes ahead on this many background browsers (Default: 0, one route at a time)",
+        default=0,
+    )
     parser.add_argument(
         "--no_headless",
         "-nh",
@@ -267,49 +531,65 @@ if __name__ == "__main__":
         login(driver)
         hub_id = find_hub_id(driver, args.hub)
 
-        for destination in args.destinations.split(","):
-            print(f"Working on route {args.hub} - {destination}")
-            if not is_extracted(args.hub, destination):
-                open_route(driver, args.hub, destination, hub_id)
-                extract_route_price_stats(driver, args.hub, destination)
-
-            seat_config_df = saved_seat_config_df(
-                args.hub, destination, args.aircraft_make, args.aircraft_model
-            )
-            if seat_config_df.empty:
-                seat_config_df = find_seat_config(
+        destinations = args.destinations.split(",")
+        if args.pipeline:
+            # Only the main browser changes game state: it opens every new route up front,
+            # extraction and seat configs then run ahead on the pool while it schedules
+            for destination in destinations:
+                if not is_extracted(args.hub, destination):
+                    open_route(driver, args.hub, destination, hub_id)
+            with BrowserPool(args.pipeline, chrome_options) as pool:
+                prepared = [
+                    pool.submit(
+                        prepare_route,
+                        args.hub,
+                        destination,
+                        args.aircraft_make,
+                        args.aircraft_model,
+                        args.solver,
+                    )
+                    for destination in destinations
+                ]
+                for destination, future in zip(destinations, prepared):
+                    try:
+                        seat_config_df = future.result()
+                    except Exception:
+                        print(f"Skipping route {args.hub} - {destination}:")
+                        traceback.print_exception(*sys.exc_info())
+                        continue
+                    schedule_route(
+                        driver,
+                        hub_id,
+                        args.hub,
+                        destination,
+                        get_aircraft_config(seat_config_df, nth=args.nth_best_config),
+                        args.aircraft_model,
+                        args.workers,
+                    )
+        else:
+            for destination in destinations:
+                if not is_extracted(args.hub, destination):
+                    open_route(driver, args.hub, destination, hub_id)
+                seat_config_df = prepare_route(
                     driver,
                     args.hub,
-                    [destination],
+                    destination,
                     args.aircraft_make,
                     args.aircraft_model,
-                    no_negative=True,
+                    args.solver,
                 )
-                save_seat_config_df(
-                    seat_config_df,
+                schedule_route(
+                    driver,
+                    hub_id,
                     args.hub,
                     destination,
-                    args.aircraft_make,
+                    get_aircraft_config(seat_config_df, nth=args.nth_best_config),
                     args.aircraft_model,
+                    args.workers,
                 )
-
-            assigned_aircrafts = find_assigned_flight_count(
-                driver, args.hub, destination
-            )
-            config = get_aircraft_config(seat_config_df, nth=args.nth_best_config)
-            assign_flights(
-                driver,
-                hub_id,
-                args.hub,
-                destination,
-                config,
-                args.aircraft_model,
-                assigned_aircrafts,
-            )
-
-            reconfigure_flight_seats(driver, args.hub, destination, config)
     except Exception:
         traceback.print_exception(*sys.exc_info())
     finally:
+        wait.print_timings()
         driver.quit()
         print("Done")
@@ -0,0 +1,282 @@
+import argparse
+import heapq
+import os
+import sys
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from selenium import webdriver
+
+import seat_batch
+from buy_aircraft import buy_aircraft
+import wait
+from create_and_schedule_route import (
+    chrome_options,
+    find_assigned_aircraft,
+    free_aircraft,
+    schedule_route,
+    select_flight,
+)
+from route import find_hub_id, login
+
+PLAN_PATH = "tmp/plan"
+OBJECTIVES = ["turnover", "roi"]
+
+
+def plan_file(name: str) -> str:
+    return f"{PLAN_PATH}/{name}.csv"
+
+
+def load_candidates(hubs: List[str], models: List[str] = None) -> pd.DataFrame:
+    """
+    Every up to date seat config of the hubs, one row per (hub, destination, model, wave count),
+    with the turnover gained by adding that wave's aircraft to the route.
+    """
+    df = pd.read_sql_query(
+        f"""
+        SELECT hub, destination, make, model, {", ".join(seat_batch.CONFIG_COLUMNS)}
+        FROM seat_configs
+        WHERE hub IN ({", ".join("?" * len(hubs))}) AND {seat_batch.FRESH_CONFIGS}
+        ORDER BY hub, destination, make, model, no
+        """,
+        seat_batch.connect(),
+        params=hubs,
+    )
+    if models:
+        df = df[df["model"].str.lower().isin([m.lower() for m in models])]
+    if df.empty:
+        raise Exception(f"No seat configs for HUB {','.join(hubs)}, run seat_batch.py first")
+
+    aircraft = seat_batch.load_all_aircraft()[["make", "model", "price"]]
+    df = df.merge(aircraft, on=["make", "model"], how="left").fillna({"price": 0})
+    # Waves are solved independently, a route only moves through them one aircraft at a time
+    keys = ["hub", "destination", "make", "model"]
+    df["gain"] = df["total_turnover"] - df.groupby(keys)["total_turnover"].shift(fill_value=0)
+    df["steps"] = df["no"] - df.groupby(keys)["no"].shift(fill_value=0)
+    return df.reset_index(drop=True)
+
+
+Assigned = Dict[Tuple[str, str], Dict[Optional[Tuple[str, str]], int]]
+
+
+def fleet_state(
+    driver, candidates: pd.DataFrame
+) -> Tuple[Assigned, Dict[Tuple[str, str, str], int]]:
+    """
+    Aircraft already flying each candidate route per (make, model), None for models without
+    seat configs, and free aircraft owned per hub and model.
+    """
+    assigned, free = {}, {}
+    for hub, routes in candidates.groupby("hub"):
+        hub_id = find_hub_id(driver, hub)
+        models = list(routes[["make", "model"]].drop_duplicates().itertuples(index=False, name=None))
+        for destination in routes["destination"].unique():
+            assigned[(hub, destination)] = find_assigned_aircraft(driver, hub, destination, models)
+        for make, model in models:
+            driver.get("http://tycoon.airlines-manager.com/network/planning")
+            select_flight(driver, hub_id, model)
+            wait.network_idle(driver)
+            free[(hub, make, model)] = len(free_aircraft(driver))
+    return assigned, free
+
+
+def score(candidates: pd.DataFrame, objective: str) -> pd.Series:
+    """Turnover gained per added aircraft, or per unit of money spent on it for roi."""
+    steps = candidates["steps"]
+    per_aircraft = candidates["gain"] / steps.where(steps > 0, 1)
+    # Waves flown by aircraft already on the route cost nothing, they go first
+    per_aircraft = per_aircraft.where(steps > 0, np.where(candidates["gain"] > 0, np.inf, 0))
+    if objective == "roi":
+        return per_aircraft / candidates["price"].where(candidates["price"] > 0, 1)
+    return per_aircraft
+
+
+def allocate(
+    candidates: pd.DataFrame,
+    fleet: int,
+    budget: float = None,
+    objective: str = "turnover",
+    assigned: Assigned = None,
+    free: Dict[Tuple[str, str, str], int] = None,
+) -> pd.DataFrame:
+    """
+    Greedy allocation by marginal score: repeatedly adds the next wave of whichever route
+    scores best, until the fleet or the budget runs out. A route keeps to the first model
+    it's given, and a route's next wave only becomes available once the previous is taken.
+    Aircraft already on a route (`assigned`, per model) count against neither limit and tie
+    the route to their model, and free owned aircraft (`free`, per hub and model) are used
+    before any are bought.
+    """
+    assigned, free = assigned or {}, dict(free or {})
+    on_route = pd.Series(
+        [
+            assigned.get(route, {}).get(model, 0)
+            for route, model in zip(
+                zip(candidates["hub"], candidates["destination"]),
+                zip(candidates["make"], candidates["model"]),
+            )
+        ],
+        index=candidates.index,
+    )
+    previous = candidates["no"] - candidates["steps"]
+    candidates = candidates.assign(
+        assigned=on_route,
+        steps=(candidates["no"] - on_route).clip(lower=0) - (previous - on_route).clip(lower=0),
+    )
+    candidates = candidates.assign(score=score(candidates, objective))
+    by_key = {
+        key: group.index.tolist()
+        for key, group in candidates.groupby(["hub", "destination", "make", "model"])
+    }
+    # Rows are sorted by wave, so position i of a route's list is its (i+1)th step
+    heap = [(-candidates.at[rows[0], "score"], key, 0) for key, rows in by_key.items()]
+    heapq.heapify(heap)
+
+    # Scheduling reconfigures every aircraft on a route, so a route already flown keeps its
+    # model, and one flown by several models or one without seat configs is left alone
+    route_models = {
+        route: next(iter(models)) if len(models) == 1 else None
+        for route, models in assigned.items()
+        if models
+    }
+    chosen, bought = {}, {}
+    aircraft, spent = 0, 0.0
+    while heap:
+        neg_score, key, position = heapq.heappop(heap)
+        row = candidates.loc[by_key[key][position]]
+        route, model = key[:2], key[2:]
+        if -neg_score <= 0 or route_models.get(route, model) != model:
+            continue
+        owned = key[:1] + model
+        buy = max(0, row["steps"] - free.get(owned, 0))
+        cost = buy * row["price"]
+        if aircraft + row["steps"] > fleet or (budget is not None and spent + cost > budget):
+            continue
+
+        route_models[route] = model
+        chosen[route] = by_key[key][position]
+        bought[route] = bought.get(route, 0) + buy
+        free[owned] = free.get(owned, 0) - (row["steps"] - buy)
+        aircraft += row["steps"]
+        spent += cost
+        if position + 1 < len(by_key[key]):
+            next_score = candidates.at[by_key[key][position + 1], "score"]
+            heapq.heappush(heap, (-next_score, key, position + 1))
+
+    plan = candidates.loc[list(chosen.values())].copy()
+    plan["buy"] = [bought[route] for route in chosen]
+    plan["cost"] = plan["buy"] * plan["price"]
+    return plan.sort_values(by=["hub", "total_turnover"], ascending=[True, False]).drop(
+        columns=["gain", "steps", "score", "total_turnover_str"], errors="ignore"
+    )
+
+
+def purchases(plan: pd.DataFrame) -> pd.DataFrame:
+    """Aircraft to buy per hub and model for the plan, in buy_aircraft's terms."""
+    df = (
+        plan.groupby(["hub", "make", "model"])
+        .agg(number=("buy", "sum"), cost=("cost", "sum"))
+        .reset_index()
+    )
+    return df[df["number"] > 0]
+
+
+def save_plan(plan: pd.DataFrame, name: str):
+    os.makedirs(PLAN_PATH, exist_ok=True)
+    plan.to_csv(plan_file(name), index=False)
+
+
+def execute_plan(driver, plan: pd.DataFrame, buy=False, workers=1):
+    """Buys the plan's aircraft if asked, then schedules and reconfigures every route of it."""
+    if buy:
+        for _, row in purchases(plan).iterrows():
+            buy_aircraft(driver, row["hub"], row["make"], row["model"], row["number"])
+
+    for hub, routes in plan.groupby("hub"):
+        hub_id = find_hub_id(driver, hub)
+        for _, config in routes.iterrows():
+            schedule_route(
+                driver, hub_id, hub, config["destination"], config, config["model"], workers
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "hubs", help="Enter HUB names to split the fleet across (comma seperated) eg: CGK,SIN"
+    )
+    parser.add_argument(
+        "--fleet",
+        "-f",
+        type=int,
+        required=True,
+        help="Maximum number of aircraft to add to routes, on top of those already flying them",
+    )
+    parser.add_argument(
+        "--budget", "-b", type=float, help="Maximum spend on bought aircraft (Default: no limit)"
+    )
+    parser.add_argument(
+        "--objective",
+        "-o",
+        choices=OBJECTIVES,
+        help="Maximize total turnover or turnover per money spent (Default: turnover)",
+        default="turnover",
+    )
+    parser.add_argument(
+        "--models",
+        "-a",
+        help="Only allocate these aircraft models (comma seperated) (Default: all with seat configs)",
+    )
+    parser.add_argument(
+        "--execute",
+        action="store_true",
+        help="Read the aircraft already assigned and free from the game, then schedule and reconfigure the plan's routes",
+    )
+    parser.add_argument(
+        "--buy", action="store_true", help="Buy the plan's aircraft first (with --execute)"
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        help="Number of logged-in browsers reconfiguring aircraft seats in parallel (Default: 1)",
+        default=1,
+    )
+    args = parser.parse_args()
+    hubs = args.hubs.split(",")
+    candidates = load_candidates(hubs, args.models.split(",") if args.models else None)
+
+    def make_plan(assigned=None, free=None) -> pd.DataFrame:
+        plan = allocate(candidates, args.fleet, args.budget, args.objective, assigned, free)
+        save_plan(plan, "_".join(hubs))
+        pd.set_option("display.max_rows", None)
+        print(
+            plan[
+                ["hub", "destination", "make", "model", "no", "assigned", "buy"]
+                + ["total_turnover", "roi", "cost"]
+            ]
+        )
+        print(purchases(plan))
+        print(
+            f"{plan['no'].sum()} aircraft ({plan['buy'].sum()} bought), "
+            f"turnover {plan['total_turnover'].sum():,.0f}, "
+            f"cost {plan['cost'].sum():,.0f}, saved to {plan_file('_'.join(hubs))}"
+        )
+        return plan
+
+    if not args.execute:
+        # Offline the game state is unknown, the plan starts from an empty fleet
+        make_plan()
+        sys.exit(0)
+    try:
+        chrome_options.add_argument("--headless")
+        driver = webdriver.Chrome(options=chrome_options)
+        login(driver)
+        plan = make_plan(*fleet_state(driver, candidates))
+        execute_plan(driver, plan, args.buy, args.workers)
+    except Exception:
+        traceback.print_exception(*sys.exc_info())
+    finally:
+        driver.quit()
@@ -2,17 +2,21 @@ import argparse
 import os
 import re
 import sys
-import time
+import threading
 import traceback
-from dataclasses import dataclass
-from typing import List, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Tuple
 
-from dataclasses_json import dataclass_json
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
 from selenium.webdriver.chrome.options import Options
 
+import route_history
+import route_store
+import wait
+from route_types import RouteStat, RouteStats
+
 non_decimal = re.compile(r"[^\d.]+")
 
 chrome_options = Options()
@@ -20,25 +24,6 @@ chrome_options.add_argument("--headless")
 chrome_options.add_argument("--window-size=1920x1080")
 
 
-@dataclass_json
-@dataclass
-class RouteStat:
-    price: int
-    demand: int
-    remaining_demand: int
-
-
-@dataclass_json
-@dataclass
-class RouteStats:
-    economy: RouteStat = None
-    business: RouteStat = None
-    first: RouteStat = None
-    cargo: RouteStat = None
-    category: int = 0
-    distance: int = 0
-
-
 def login(driver):
     driver.get("http://tycoon.airlines-manager.com/network/")
     username = driver.find_element("id", "username")
@@ -49,6 +34,65 @@ def login(driver):
     login.click()
 
 
+def new_logged_in_driver(options: Options = chrome_options):
+    driver = webdriver.Chrome(options=options)
+    login(driver)
+    return driver
+
+
+class BrowserPool:
+    """
+    Thread pool whose workers each log in once and keep their browser, for tasks whose
+    results are needed back: submit(task, *args) runs task(driver, *args) on a worker.
+    """
+
+    def __init__(self, workers: int, options: Options = chrome_options):
+        self.options = options
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.local = threading.local()
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    def driver(self):
+        if not hasattr(self.local, "driver"):
+            self.local.driver = new_logged_in_driver(self.options)
+            with self.lock:
+                self.drivers.append(self.local.driver)
+        return self.local.driver
+
+    def submit(self, task: Callable[..., Any], *args) -> Future:
+        return self.executor.submit(lambda: task(self.driver(), *args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for driver in self.drivers:
+            driver.quit()
+
+
+def run_in_browser_pool(
+    items: List[Any],
+    task: Callable[[Any, Any], None],
+    workers: int,
+    options: Options = chrome_options,
+) -> List[Any]:
+    """
+    Runs task(driver, item) for every item on a BrowserPool, each worker logs in once.
+    Returns the items whose task raised.
+    """
+    failed = []
+    with BrowserPool(max(1, min(workers, len(items))), options) as pool:
+        futures = {pool.submit(task, item): item for item in items}
+        for future in as_completed(futures):
+            error = future.exception()
+            if error:
+                traceback.print_exception(type(error), error, error.__traceback__)
+                failed.append(futures[future])
+    return failed
+
+
 def find_hub_id(driver, hub: str) -> int:
     driver.get("http://tycoon.airlines-manager.com/network/")
     driver.find_elements(By.XPATH, '//*[@id="lineList"]/div')
@@ -147,20 +191,19 @@ def extract_route_stat(priceList) -> Tuple[str, RouteStat]:
 
 
 def save_output(hub: str, route: str, route_stats: RouteStats):
-    if not os.path.exists(f"tmp/{hub}"):
-        os.makedirs(f"tmp/{hub}")
-    with open(f"tmp/{hub}/{route}.json", "w+") as f:
-        f.write(route_stats.to_json())
+    route_store.save_route_stats(hub, route, route_stats)
 
 
 def is_extracted(hub: str, route: str):
-    return os.path.exists(f"tmp/{hub}/{route}.json")
+    return route_store.route_stats_timestamp(hub, route) is not None
 
 
-def extract_route_price_stats(driver, hub: str, route: str, force=False):
+def extract_route_price_stats(
+    driver, hub: str, route: str, force=False, get_stats=get_route_stats
+):
     if route and (not is_extracted(hub, route) or force):
         route_name = f"{hub} - {route}"
-        route_stats = get_route_stats(driver, route_name)
+        route_stats = get_stats(driver, route_name)
         save_output(hub, route, route_stats)
         print(f"{route_name}: \n\t {route_stats}")
 
@@ -178,6 +221,43 @@ if __name__ == "__main__":
     parser.add_argument(
         "--force", "-f", action="store_true", help="Force extract all routes for HUB"
     )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        help="No. of browsers, or concurrent requests for http/async backends, extracting routes in parallel (Default: 1)",
+        default=1,
+    )
+    parser.add_argument(
+        "--backend",
+        "-b",
+        choices=["selenium", "http", "async"],
+        help="Scrape with a headless browser, plain HTTP requests or concurrent asyncio requests (Default: selenium)",
+        default="selenium",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Max requests started per second with the async backend (Default: 2)",
+        default=2.0,
+    )
+    parser.add_argument(
+        "--refresh",
+        "-r",
+        action="store_true",
+        help="Re-extract only routes with stale stats, most stale and highest demand first",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        help="Hours before a route's stats are stale (Default: 6)",
+        default=route_store.DEFAULT_TTL / 3600,
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        help="Max no. of stale routes to refresh in one run (Default: all)",
+    )
     parser.add_argument(
         "--skip_extraction",
         "-s",
@@ -185,6 +265,42 @@ if __name__ == "__main__":
         help="Skip extracting route stats for HUB, used to check all purchased routes.",
     )
     args = parser.parse_args()
+
+    def select_routes(routes: List[str]) -> List[str]:
+        if not args.refresh:
+            return routes
+        stale = route_store.stale_routes(args.hub, routes, args.ttl * 3600)[: args.limit]
+        print(f"Refreshing {len(stale)} stale routes of {len(routes)}")
+        return stale
+
+    force = args.force or args.refresh
+    if args.backend == "http":
+        from route_http import extract_hub_routes
+
+        extract_hub_routes(
+            args.hub,
+            args.destination,
+            force,
+            args.workers,
+            args.skip_extraction,
+            select_routes,
+        )
+        route_history.compact(args.hub)
+        sys.exit(0)
+    if args.backend == "async":
+        from route_async import extract_hub_routes
+
+        extract_hub_routes(
+            args.hub,
+            args.destination,
+            force,
+            args.workers,
+            args.rate,
+            args.skip_extraction,
+            select_routes,
+        )
+        route_history.compact(args.hub)
+        sys.exit(0)
     try:
         driver = webdriver.Chrome(options=chrome_options)
         login(driver)
@@ -194,11 +310,23 @@ if __name__ == "__main__":
         else:
             routes = [args.destination.upper()]
         print(f"All routes from HUB {args.hub}:\n" + "\n".join(routes))
-        if not args.skip_extraction:
+        routes = select_routes(routes)
+        if not args.skip_extraction and args.workers > 1:
+            failed = run_in_browser_pool(
+                routes,
+                lambda worker, route: extract_route_price_stats(
+                    worker, args.hub, route, force
+                ),
+                args.workers,
+            )
+            if failed:
+                print("Failed to extract routes: " + ",".join(failed))
+        elif not args.skip_extraction:
             for route in routes:
-                extract_route_price_stats(driver, args.hub, route, args.force)
+                extract_route_price_stats(driver, args.hub, route, force)
+        route_history.compact(args.hub)
     except Exception as ex:
         traceback.print_exception(*sys.exc_info())
     finally:
-        time.sleep(5)
+        wait.print_timings()
         driver.quit()
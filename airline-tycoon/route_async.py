@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+from typing import Callable, List
+from urllib.parse import urljoin
+
+import aiohttp
+from lxml import html
+
+from route import RouteStats, is_extracted, save_output
+from route_http import (
+    BASE_URL,
+    login_form_data,
+    parse_destinations,
+    parse_distance,
+    parse_hub_id,
+    parse_max_category,
+    parse_route_prices,
+    prices_url,
+    route_url,
+)
+
+
+class RateLimiter:
+    """Spaces out request starts to at most `rate` per second across all tasks."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            delay = self.next_start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start = max(self.next_start, time.monotonic()) + self.interval
+
+
+class AsyncScraper:
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int, rate: float, base_url: str = BASE_URL):
+        self.session = session
+        self.in_flight = asyncio.Semaphore(concurrency)
+        self.rate_limiter = RateLimiter(rate)
+        self.base_url = base_url
+
+    async def get_page(self, url: str):
+        async with self.in_flight:
+            await self.rate_limiter.wait()
+            async with self.session.get(urljoin(self.base_url, url)) as response:
+                response.raise_for_status()
+                return html.fromstring(await response.read(), base_url=str(response.url))
+
+    async def login(self):
+        action, data = login_form_data(await self.get_page("/network/"))
+        async with self.in_flight:
+            await self.rate_limiter.wait()
+            async with self.session.post(action, data=data) as response:
+                response.raise_for_status()
+
+    async def get_route_stats(self, network_page, route_text: str) -> RouteStats:
+        route_page = await self.get_page(route_url(network_page, route_text))
+        route_stats = RouteStats(
+            category=parse_max_category(route_page), distance=parse_distance(route_page)
+        )
+        return parse_route_prices(await self.get_page(prices_url(route_page)), route_stats)
+
+    async def extract_route_price_stats(self, network_page, hub: str, route: str):
+        route_name = f"{hub} - {route}"
+        route_stats = await self.get_route_stats(network_page, route_name)
+        save_output(hub, route, route_stats)
+        print(f"{route_name}: \n\t {route_stats}")
+
+
+async def extract_hub_routes_async(
+    hub: str,
+    destination: str,
+    force=False,
+    concurrency=4,
+    rate=2.0,
+    skip_extraction=False,
+    base_url: str = BASE_URL,
+    select_routes: Callable[[List[str]], List[str]] = None,
+) -> List[str]:
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        scraper = AsyncScraper(session, concurrency, rate, base_url)
+        await scraper.login()
+        # The network page holds both the hub list and the linePicker used to find each route
+        network_page = await scraper.get_page("/network/")
+        hub_id = parse_hub_id(network_page, hub)
+        print(f"Hub ID for {hub} == {hub_id}")
+        if destination.upper() == "ALL":
+            routes = parse_destinations(
+                await scraper.get_page(f"/network/showhub/{hub_id}/linelist"), hub
+            )
+        else:
+            routes = [destination.upper()]
+        print(f"All routes from HUB {hub}:\n" + "\n".join(routes))
+        if skip_extraction:
+            return []
+        if select_routes:
+            routes = select_routes(routes)
+
+        routes = [route for route in routes if force or not is_extracted(hub, route)]
+        results = await asyncio.gather(
+            *[scraper.extract_route_price_stats(network_page, hub, route) for route in routes],
+            return_exceptions=True,
+        )
+        failed = []
+        for route, result in zip(routes, results):
+            if isinstance(result, Exception):
+                print(f"{route}: {result}")
+                failed.append(route)
+        if failed:
+            print("Failed to extract routes: " + ",".join(failed))
+        return failed
+
+
+def extract_hub_routes(
+    hub: str,
+    destination: str,
+    force=False,
+    concurrency=4,
+    rate=2.0,
+    skip_extraction=False,
+    select_routes: Callable[[List[str]], List[str]] = None,
+):
+    return asyncio.run(
+        extract_hub_routes_async(
+            hub,
+            destination,
+            force,
+            concurrency,
+            rate,
+            skip_extraction,
+            os.getenv("TYCOON_BASE_URL", BASE_URL),
+            select_routes,
+        )
+    )
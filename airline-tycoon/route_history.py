@@ -0,0 +1,145 @@
+import argparse
+import os
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+import route_store
+
+HISTORY_PATH = "tmp/history"
+MISSING = -1
+
+
+def history_file(hub: str) -> str:
+    return f"{HISTORY_PATH}/{hub}.npz"
+
+
+def load_arrays(hub: str) -> dict:
+    """Columnar history of a hub: one array per stat column plus timestamp and destination codes."""
+    if not os.path.exists(history_file(hub)):
+        return {
+            "destinations": np.array([], dtype="U3"),
+            "destination": np.array([], dtype=np.uint16),
+            "timestamp": np.array([], dtype=np.float64),
+            **{column: np.array([], dtype=np.int32) for column in route_store.COLUMNS},
+        }
+    with np.load(history_file(hub)) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def save_arrays(hub: str, arrays: dict):
+    os.makedirs(HISTORY_PATH, exist_ok=True)
+    tmp_file = history_file(hub) + ".tmp.npz"
+    np.savez_compressed(tmp_file, **arrays)
+    os.replace(tmp_file, history_file(hub))
+
+
+def append_rows(arrays: dict, rows: List[tuple]) -> dict:
+    """Appends (destination, timestamp, *COLUMNS) rows, re-using the destination code table."""
+    destinations = list(arrays["destinations"])
+    codes = {destination: i for i, destination in enumerate(destinations)}
+    for row in rows:
+        if row[0] not in codes:
+            codes[row[0]] = len(destinations)
+            destinations.append(row[0])
+
+    appended = {
+        "destinations": np.array(destinations, dtype="U3"),
+        "destination": np.concatenate(
+            [arrays["destination"], np.array([codes[row[0]] for row in rows], dtype=np.uint16)]
+        ),
+        "timestamp": np.concatenate(
+            [arrays["timestamp"], np.array([row[1] for row in rows], dtype=np.float64)]
+        ),
+    }
+    for i, column in enumerate(route_store.COLUMNS):
+        values = np.array(
+            [MISSING if row[i + 2] is None else row[i + 2] for row in rows], dtype=np.int32
+        )
+        appended[column] = np.concatenate([arrays[column], values])
+    return appended
+
+
+def compact(hub: str) -> int:
+    """
+    Moves every snapshot but the latest per route out of the SQLite store into the
+    hub's columnar history file, keeping the store small and lookups fast.
+    """
+    conn = route_store.connect()
+    old_rows = conn.execute(
+        f"""
+        SELECT destination, timestamp, {", ".join(route_store.COLUMNS)}
+        FROM route_stats AS r
+        WHERE hub = ? AND timestamp < (
+            SELECT MAX(timestamp) FROM route_stats
+            WHERE hub = r.hub AND destination = r.destination
+        )
+        """,
+        [hub],
+    ).fetchall()
+    if not old_rows:
+        return 0
+
+    save_arrays(hub, append_rows(load_arrays(hub), old_rows))
+    with conn:
+        conn.executemany(
+            "DELETE FROM route_stats WHERE hub = ? AND destination = ? AND timestamp = ?",
+            [(hub, row[0], row[1]) for row in old_rows],
+        )
+    return len(old_rows)
+
+
+def route_history_df(hub: str, destinations: List[str] = None, since: float = None) -> pd.DataFrame:
+    """Every stored snapshot of the hub (archived and latest) indexed by (destination, time)."""
+    arrays = load_arrays(hub)
+    history = pd.DataFrame(
+        {column: arrays[column] for column in route_store.COLUMNS}
+    ).replace(MISSING, np.nan)
+    history.insert(0, "timestamp", arrays["timestamp"])
+    history.insert(0, "destination", arrays["destinations"][arrays["destination"]])
+
+    latest = route_store.hub_route_stats_df(hub).reset_index()
+    df = pd.concat([history, latest], ignore_index=True)
+    if destinations:
+        df = df[df["destination"].isin(destinations)]
+    if since:
+        df = df[df["timestamp"] >= since]
+    df["time"] = pd.to_datetime(df["timestamp"], unit="s")
+    return df.drop(columns="timestamp").set_index(["destination", "time"]).sort_index()
+
+
+def demand_price_trends(
+    hub: str, destinations: List[str] = None, since: float = None, freq: str = "D"
+) -> pd.DataFrame:
+    """Mean demand, remaining demand and price per class for each route, resampled to `freq`."""
+    df = route_history_df(hub, destinations, since)
+    columns = [c for c in route_store.COLUMNS if c not in route_store.FIELD_CLASSES["route"]]
+    return (
+        df[columns]
+        .groupby(level="destination")
+        .resample(freq, level="time")
+        .mean()
+        .dropna(how="all")
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hub", help="Enter HUB name to show route demand and price trends for")
+    parser.add_argument(
+        "--destinations",
+        "-d",
+        help="List of destination airport code (comma seperated) (Default: all)",
+    )
+    parser.add_argument(
+        "--freq", help="Pandas resample frequency for the trends (Default: D)", default="D"
+    )
+    args = parser.parse_args()
+    print(f"Archived {compact(args.hub)} snapshots for HUB {args.hub}")
+    pd.set_option("display.max_columns", None)
+    print(
+        demand_price_trends(
+            args.hub, args.destinations.split(",") if args.destinations else None, freq=args.freq
+        )
+    )
@@ -0,0 +1,189 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import requests
+from lxml import html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from route import RouteStat, RouteStats, extract_route_price_stats, non_decimal
+
+BASE_URL = "https://tycoon.airlines-manager.com"
+
+
+def new_session(pool_size: int = 10) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_page(session: requests.Session, url: str):
+    response = session.get(urljoin(BASE_URL, url))
+    response.raise_for_status()
+    return html.fromstring(response.content, base_url=response.url)
+
+
+def text_of(element) -> str:
+    return " ".join(element.text_content().split())
+
+
+def login_form_data(page) -> Tuple[str, dict]:
+    form = page.xpath('//form[.//*[@id="username"]]')[0]
+    data = {
+        field.name: field.value or ""
+        for field in form.inputs
+        if field.name and field.get("type") not in ("submit", "button")
+    }
+    data[page.get_element_by_id("username").name] = os.getenv("TYCOON_EMAIL")
+    data[page.get_element_by_id("password").name] = os.getenv("TYCOON_PASSWORD")
+    return urljoin(page.base_url, form.action or page.base_url), data
+
+
+def login(session: requests.Session):
+    action, data = login_form_data(get_page(session, "/network/"))
+    session.post(action, data=data).raise_for_status()
+
+
+def parse_hub_id(page, hub: str) -> Optional[int]:
+    for hub_element in page.xpath(
+        '//*[@id="displayRegular"]/div[@class="hubListBox"]/div'
+    ):
+        match = re.search("Hub ([A-Z]{3}) -", text_of(hub_element))
+        if match and match.group(1) == hub:
+            link = hub_element.xpath('.//a[normalize-space(text())="Hub details"]')[0]
+            return int(link.get("href").rstrip("/").split("/")[-1])
+
+
+def find_hub_id(network_page, hub: str) -> int:
+    hub_id = parse_hub_id(network_page, hub)
+    print(f"Hub ID for {hub} == {hub_id}")
+    return hub_id
+
+
+def parse_destinations(page, hub: str) -> List[str]:
+    destinations = []
+    for route_element in page.xpath('//*[@id="lineList"]/div'):
+        if "lineListBox" in route_element.get("class", ""):
+            title = text_of(route_element.find_class("title")[0])
+            match = re.search(r"([A-Z]{3}) / ([A-Z]{3})", title)
+            if match and match.group(1) == hub:
+                destinations.append(match.group(2))
+    return destinations
+
+
+def get_all_routes(session: requests.Session, hub: str, hub_id: int) -> List[str]:
+    return parse_destinations(
+        get_page(session, f"/network/showhub/{hub_id}/linelist"), hub
+    )
+
+
+def route_url(page, route_text: str) -> str:
+    """
+    The route page the linePicker's change handler navigates to in the browser: the option
+    value is either the page's path or just the line id, which lives under /network/showline/.
+    """
+    for option in page.find_class("linePicker")[0].xpath(".//option"):
+        if text_of(option) == route_text:
+            value = option.get("value", "").strip()
+            if value.isdigit():
+                value = f"/network/showline/{value}"
+            return urljoin(page.base_url, value)
+    raise Exception(f"Can't find route {route_text}")
+
+
+def parse_max_category(page) -> Optional[int]:
+    alts = page.xpath('//*[@id="box2"]/li[1]/b/img[3]/@alt')
+    if alts:
+        return int(non_decimal.sub("", alts[0]))
+
+
+def parse_distance(page) -> int:
+    return int(non_decimal.sub("", text_of(page.xpath('//*[@id="box2"]/li[2]')[0])))
+
+
+def parse_route_stat(price_list) -> Tuple[str, RouteStat]:
+    return (
+        text_of(price_list.find_class("title")[0]).replace("class", "").strip().lower(),
+        RouteStat(
+            price=non_decimal.sub(
+                "", text_of(price_list.find_class("price")[0].xpath(".//b")[0])
+            ),
+            demand=non_decimal.sub("", text_of(price_list.find_class("demand")[0])),
+            remaining_demand=non_decimal.sub(
+                "", text_of(price_list.find_class("paxLeft")[0])
+            ),
+        ),
+    )
+
+
+def parse_route_prices(page, route_stats: RouteStats) -> RouteStats:
+    for price_list in page.xpath(
+        '//*[@id="marketing_linePricing"]/div[@class="box2"]/div'
+    ):
+        route_stats.__setattr__(*parse_route_stat(price_list))
+    return route_stats
+
+
+def prices_url(route_page) -> str:
+    link = route_page.xpath('//a[normalize-space(text())="Route prices"]')[0]
+    return urljoin(route_page.base_url, link.get("href"))
+
+
+def get_route_stats(session: requests.Session, network_page, route_text: str) -> RouteStats:
+    route_page = get_page(session, route_url(network_page, route_text))
+    route_stats = RouteStats(
+        category=parse_max_category(route_page), distance=parse_distance(route_page)
+    )
+    return parse_route_prices(get_page(session, prices_url(route_page)), route_stats)
+
+
+def extract_hub_routes(
+    hub: str,
+    destination: str,
+    force=False,
+    workers=1,
+    skip_extraction=False,
+    select_routes: Callable[[List[str]], List[str]] = None,
+):
+    session = new_session(pool_size=workers)
+    login(session)
+    # The network page holds both the hub list and the linePicker used to find each route
+    network_page = get_page(session, "/network/")
+    hub_id = find_hub_id(network_page, hub)
+    if destination.upper() == "ALL":
+        routes = get_all_routes(session, hub, hub_id)
+    else:
+        routes = [destination.upper()]
+    print(f"All routes from HUB {hub}:\n" + "\n".join(routes))
+    if skip_extraction:
+        return
+    if select_routes:
+        routes = select_routes(routes)
+
+    def get_stats(session: requests.Session, route_text: str) -> RouteStats:
+        return get_route_stats(session, network_page, route_text)
+
+    # The logged-in session (cookies + pooled connections) is shared by all workers
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                extract_route_price_stats, session, hub, route, force, get_stats
+            ): route
+            for route in routes
+        }
+        failed = []
+        for future in as_completed(futures):
+            if future.exception():
+                print(f"{futures[future]}: {future.exception()}")
+                failed.append(futures[future])
+    if failed:
+        print("Failed to extract routes: " + ",".join(failed))
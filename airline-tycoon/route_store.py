@@ -0,0 +1,193 @@
+import argparse
+import glob
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from route_types import RouteStat, RouteStats
+
+DB_PATH = "tmp/route_stats.db"
+CLASSES = ["economy", "business", "first", "cargo"]
+STAT_FIELDS = ["price", "demand", "remaining_demand"]
+COLUMNS = [f"{c}_{f}" for c in CLASSES for f in STAT_FIELDS] + ["category", "distance"]
+
+# Columns grouped by what they describe, a scrape always refreshes all of them together
+FIELD_CLASSES = {
+    "demand": [f"{c}_{f}" for c in CLASSES for f in ["demand", "remaining_demand"]],
+    "price": [f"{c}_price" for c in CLASSES],
+    "route": ["category", "distance"],
+}
+# Set by the fastest changing class, demand
+DEFAULT_TTL = 6 * 3600
+
+_local = threading.local()
+
+
+def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """One connection per thread and process, browser pool and batch workers use it concurrently."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    # Connections inherited through fork can't be shared with the parent
+    key = (os.getpid(), db_path)
+    if key not in connections:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS route_stats (
+                hub TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                {", ".join(f"{column} INTEGER" for column in COLUMNS)},
+                PRIMARY KEY (hub, destination, timestamp)
+            )
+            """
+        )
+        connections[key] = conn
+    return connections[key]
+
+
+def to_row(route_stats: RouteStats) -> List[Optional[int]]:
+    row = []
+    for c in CLASSES:
+        stat = getattr(route_stats, c)
+        for f in STAT_FIELDS:
+            value = getattr(stat, f) if stat else None
+            row.append(int(value) if value not in (None, "") else None)
+    return row + [route_stats.category, route_stats.distance]
+
+
+def from_row(row: Iterable) -> RouteStats:
+    values = dict(zip(COLUMNS, row))
+    route_stats = RouteStats(category=values["category"], distance=values["distance"])
+    for c in CLASSES:
+        stat = [values[f"{c}_{f}"] for f in STAT_FIELDS]
+        if any(v is not None for v in stat):
+            setattr(route_stats, c, RouteStat(*stat))
+    return route_stats
+
+
+def save_route_stats_bulk(
+    hub: str,
+    route_stats: Dict[str, RouteStats],
+    timestamp: float = None,
+    db_path: str = DB_PATH,
+):
+    timestamp = timestamp or time.time()
+    conn = connect(db_path)
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO route_stats VALUES ({', '.join('?' * (len(COLUMNS) + 3))})",
+            [
+                [hub, destination, timestamp] + to_row(stats)
+                for destination, stats in route_stats.items()
+            ],
+        )
+
+
+def save_route_stats(
+    hub: str, destination: str, route_stats: RouteStats, timestamp: float = None
+):
+    save_route_stats_bulk(hub, {destination: route_stats}, timestamp)
+
+
+def latest_rows(hub: str, destinations: List[str] = None, db_path: str = DB_PATH):
+    query = f"""
+        SELECT destination, timestamp, {", ".join(COLUMNS)}
+        FROM route_stats AS r
+        WHERE hub = ? AND timestamp = (
+            SELECT MAX(timestamp) FROM route_stats
+            WHERE hub = r.hub AND destination = r.destination
+        )
+    """
+    params = [hub]
+    if destinations:
+        query += f" AND destination IN ({', '.join('?' * len(destinations))})"
+        params += destinations
+    return connect(db_path).execute(query, params).fetchall()
+
+
+def load_hub_route_stats(
+    hub: str, destinations: List[str] = None
+) -> Dict[str, Tuple[float, RouteStats]]:
+    """Latest (timestamp, RouteStats) for every stored destination of the hub, in one query."""
+    return {row[0]: (row[1], from_row(row[2:])) for row in latest_rows(hub, destinations)}
+
+
+def load_route_stats(hub: str, destination: str) -> Optional[RouteStats]:
+    latest = load_hub_route_stats(hub, [destination])
+    return latest[destination][1] if destination in latest else None
+
+
+def route_stats_timestamp(hub: str, destination: str) -> Optional[float]:
+    row = (
+        connect()
+        .execute(
+            "SELECT MAX(timestamp) FROM route_stats WHERE hub = ? AND destination = ?",
+            [hub, destination],
+        )
+        .fetchone()
+    )
+    return row[0]
+
+
+def hub_route_stats_df(hub: str) -> pd.DataFrame:
+    return pd.DataFrame(
+        latest_rows(hub), columns=["destination", "timestamp"] + COLUMNS
+    ).set_index("destination")
+
+
+def stale_routes(
+    hub: str, routes: List[str], ttl: float = DEFAULT_TTL, now: float = None
+) -> List[str]:
+    """
+    Routes whose stats are older than `ttl` seconds, never extracted routes first. The rest
+    are grouped by how many whole TTLs old they are, most stale group first, and ordered by
+    remaining demand (highest first) within a group.
+    """
+    now = now or time.time()
+    latest = load_hub_route_stats(hub, routes)
+    scored = []
+    for destination in routes:
+        if destination not in latest:
+            scored.append((float("inf"), 0, destination))
+            continue
+        timestamp, route_stats = latest[destination]
+        age = now - timestamp
+        if age > ttl:
+            remaining_demand = sum(
+                int(getattr(route_stats, c).remaining_demand or 0)
+                for c in CLASSES
+                if getattr(route_stats, c)
+            )
+            scored.append((age // ttl, remaining_demand, destination))
+    return [destination for _, _, destination in sorted(scored, reverse=True)]
+
+
+def import_json_files(hub: str) -> int:
+    """Bulk loads the old per-route tmp/{hub}/{destination}.json files into the store."""
+    by_timestamp = {}
+    for path in glob.glob(f"tmp/{hub}/*.json"):
+        with open(path, "r") as f:
+            route_stats = RouteStats.from_json(f.read())
+        destination = os.path.splitext(os.path.basename(path))[0]
+        by_timestamp.setdefault(os.path.getmtime(path), {})[destination] = route_stats
+    for timestamp, route_stats in by_timestamp.items():
+        save_route_stats_bulk(hub, route_stats, timestamp)
+    return sum(len(route_stats) for route_stats in by_timestamp.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "hubs", help="Import tmp/{HUB}/*.json route stats into the store (comma seperated)"
+    )
+    args = parser.parse_args()
+    for hub in args.hubs.split(","):
+        print(f"Imported {import_json_files(hub)} routes for HUB {hub}")
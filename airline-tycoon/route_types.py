@@ -0,0 +1,22 @@
+from dataclasses import dataclass
+
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass
+class RouteStat:
+    price: int
+    demand: int
+    remaining_demand: int
+
+
+@dataclass_json
+@dataclass
+class RouteStats:
+    economy: RouteStat = None
+    business: RouteStat = None
+    first: RouteStat = None
+    cargo: RouteStat = None
+    category: int = 0
+    distance: int = 0
@@ -1,21 +1,17 @@
 import argparse
-import os
 import sys
-import time
 import traceback
 from dataclasses import dataclass
 from typing import List
 
 import pandas as pd
-from retry import retry
 from selenium import webdriver
-from selenium.common.exceptions import (
-    ElementClickInterceptedException,
-    NoSuchElementException,
-)
+from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
 
+import route_store
+import wait
 from route import RouteStats, non_decimal
 
 
@@ -34,14 +30,15 @@ class WaveStat:
     max_configured: str
 
 
+CIRCUIT_ROWS = '//*[@id="nwy_seatconfigurator_circuitinfo"]/table/tbody/tr'
+
+
 def js_click(driver, element):
     driver.execute_script("arguments[0].click();", element)
 
 
 def clear_previous_configs(driver):
-    rows = driver.find_elements(
-        By.XPATH, '//*[@id="nwy_seatconfigurator_circuitinfo"]/table/tbody/tr'
-    )
+    rows = driver.find_elements(By.XPATH, CIRCUIT_ROWS)
     for row in rows:
         try:
             row.find_element(By.XPATH, "td[10]/input").click()
@@ -74,14 +71,21 @@ def find_seat_config(
     for destination in destinations:
         fillin_route_stats(driver, source, destination)
 
-    time.sleep(5)
+    wait.until(
+        driver,
+        lambda d: len(d.find_elements(By.XPATH, CIRCUIT_ROWS)) >= len(destinations),
+        "circuit filled",
+    )
+    wait.network_idle(driver)
     calculate_seat_config(driver, no_negative)
     wave_stats = scan_seat_configs(driver)
     clear_previous_configs(driver)
     return seat_configs_df(wave_stats)
 
 
-def seat_configs_df(wave_stats) -> pd.DataFrame:
+def seat_configs_df(wave_stats, show=True) -> pd.DataFrame:
+    if not wave_stats:
+        raise Exception("No viable seat config, even the first wave sells no seats")
     df = pd.DataFrame(wave_stats)
     df["total_turnover"] = pd.to_numeric(df["total_turnover"], downcast="integer")
     df["turnover_per_wave"] = pd.to_numeric(df["turnover_per_wave"], downcast="integer")
@@ -89,25 +93,21 @@ def seat_configs_df(wave_stats) -> pd.DataFrame:
     df["note"] = ""
     df.iloc[df["roi"].idxmax(), df.columns.get_loc("note")] = "Best ROI"
     df.iloc[df["total_turnover"].idxmax(), df.columns.get_loc("note")] = "Best Turnover"
-    print(df)
+    if show:
+        print(df)
     return df
 
 
-@retry((NoSuchElementException, ElementClickInterceptedException), delay=5, tries=6)
 def calculate_seat_config(driver, no_negative=False):
     if no_negative:
-        js_click(driver, driver.find_element("id", "nonegativeconfig"))
+        js_click(driver, wait.clickable(driver, (By.ID, "nonegativeconfig")))
 
-    js_click(driver, driver.find_element("id", "calculate_button"))
+    js_click(driver, wait.clickable(driver, (By.ID, "calculate_button")))
 
 
-@retry(ElementClickInterceptedException, delay=5, tries=6)
 def change_to_airport_codes(driver):
-    try:
-        for el in driver.find_elements(By.LINK_TEXT, "Quick Entry"):
-            el.click()
-    except NoSuchElementException:
-        pass
+    for el in driver.find_elements(By.LINK_TEXT, "Quick Entry"):
+        wait.click(driver, el)
 
 
 def fillin_route_stats(driver, source: str, destination: str):
@@ -133,9 +133,8 @@ def fillin_route_stats(driver, source: str, destination: str):
     add_to_circuit(driver)
 
 
-@retry(ElementClickInterceptedException, delay=5, tries=6)
 def add_to_circuit(driver):
-    js_click(driver, driver.find_element("id", "add2circuit_button"))
+    js_click(driver, wait.clickable(driver, (By.ID, "add2circuit_button")))
 
 
 def scan_seat_configs(driver, maxWave=10):
@@ -150,9 +149,8 @@ def scan_seat_configs(driver, maxWave=10):
     return wave_stats
 
 
-@retry(NoSuchElementException, delay=5, tries=6)
 def extract_wave_config(driver, wave: int):
-    wave_stat_el = driver.find_element("id", f"nwy_seatconfigurator_wave_{wave}_stats")
+    wave_stat_el = wait.present(driver, (By.ID, f"nwy_seatconfigurator_wave_{wave}_stats"))
     seat_config_el = wave_stat_el.find_elements(
         By.XPATH,
         "table[1]/tbody/tr[3]/td",
@@ -197,12 +195,11 @@ def select_wave(driver, wave: int):
 
 
 def read_route_stats(source: str, destination: str):
-    stats_path = f"tmp/{source}/{destination}.json"
-    if not os.path.exists(stats_path):
-        raise Exception(f"Can't find stats at {stats_path}")
+    route_stats = route_store.load_route_stats(source, destination)
+    if route_stats is None:
+        raise Exception(f"Can't find stats for {source} - {destination}")
 
-    with open(stats_path, "r") as f:
-        return RouteStats.from_json(f.read())
+    return route_stats
 
 
 if __name__ == "__main__":
@@ -242,5 +239,5 @@ if __name__ == "__main__":
     except Exception:
         traceback.print_exception(*sys.exc_info())
     finally:
-        time.sleep(5)
+        wait.print_timings()
         driver.quit()
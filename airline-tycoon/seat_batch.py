@@ -0,0 +1,206 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import fields
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+import route_store
+from route_types import RouteStats
+from seat import WaveStat
+from seat_solver import AIRCRAFT_DATA, seat_config_from_stats
+
+CONFIG_COLUMNS = [field.name for field in fields(WaveStat)] + ["note"]
+# Configs computed before the route's latest stats were scraped are out of date
+FRESH_CONFIGS = """
+    timestamp >= COALESCE((
+        SELECT MAX(timestamp) FROM route_stats AS r
+        WHERE r.hub = seat_configs.hub AND r.destination = seat_configs.destination
+    ), 0)
+"""
+
+
+def connect():
+    """Seat configs live next to the route stats, one row per (route, aircraft model, wave)."""
+    conn = route_store.connect()
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS seat_configs (
+            hub TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            make TEXT NOT NULL COLLATE NOCASE,
+            model TEXT NOT NULL COLLATE NOCASE,
+            timestamp REAL NOT NULL,
+            no INTEGER NOT NULL,
+            economy INTEGER,
+            business INTEGER,
+            first INTEGER,
+            cargo INTEGER,
+            turnover_per_wave REAL,
+            roi REAL,
+            total_turnover REAL,
+            turnover_days INTEGER,
+            max_configured TEXT,
+            note TEXT,
+            PRIMARY KEY (hub, destination, make, model, no)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS seat_configs_by_model ON seat_configs (hub, make, model, total_turnover)"
+    )
+    return conn
+
+
+def load_all_aircraft(path: str = AIRCRAFT_DATA) -> pd.DataFrame:
+    if not os.path.exists(path):
+        raise Exception(
+            f"Can't find aircraft data at {path}, run aircraft_data.py to scrape it from the buy pages"
+        )
+    return pd.read_csv(path)
+
+
+def solve_model(
+    aircraft: pd.Series, route_stats: Dict[str, RouteStats], no_negative=True
+) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """Seat configs of one aircraft model for every destination, plus the destinations it can't fly."""
+    dfs, errors = [], {}
+    for destination, stats in route_stats.items():
+        try:
+            df = seat_config_from_stats([stats], aircraft, no_negative, show=False)
+        except Exception as e:
+            errors[destination] = str(e)
+            continue
+        df.insert(0, "destination", destination)
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(columns=["destination"] + CONFIG_COLUMNS), errors
+    return pd.concat(dfs, ignore_index=True)[["destination"] + CONFIG_COLUMNS], errors
+
+
+def save_seat_configs(hub: str, make: str, model: str, df: pd.DataFrame, timestamp: float = None):
+    """Replaces the stored configs of the model for the destinations in `df`."""
+    timestamp = timestamp or time.time()
+    conn = connect()
+    with conn:
+        conn.executemany(
+            "DELETE FROM seat_configs WHERE hub = ? AND destination = ? AND make = ? AND model = ?",
+            [(hub, destination, make, model) for destination in df["destination"].unique()],
+        )
+        conn.executemany(
+            f"INSERT INTO seat_configs VALUES ({', '.join('?' * (len(CONFIG_COLUMNS) + 5))})",
+            [
+                [hub, row["destination"], make, model, timestamp]
+                + [row[column] for column in CONFIG_COLUMNS]
+                for row in df.astype(object).to_dict("records")
+            ],
+        )
+
+
+def load_seat_configs(hub: str, destination: str, make: str, model: str) -> pd.DataFrame:
+    """
+    Stored configs in the same shape as seat.seat_configs_df,
+    empty if never computed or computed from older route stats.
+    """
+    df = pd.read_sql_query(
+        f"""
+        SELECT {", ".join(CONFIG_COLUMNS)} FROM seat_configs
+        WHERE hub = ? AND destination = ? AND make = ? AND model = ? AND {FRESH_CONFIGS}
+        ORDER BY no
+        """,
+        connect(),
+        params=[hub, destination, make, model],
+    )
+    if not df.empty:
+        df.insert(
+            len(CONFIG_COLUMNS) - 1,
+            "total_turnover_str",
+            df["total_turnover"].map("{:,.0f}".format),
+        )
+    return df
+
+
+def batch_seat_configs(
+    hub: str,
+    destinations: List[str] = None,
+    models: List[str] = None,
+    workers: int = None,
+    no_negative=True,
+) -> pd.DataFrame:
+    """
+    Computes seat configs for every stored destination of the hub against every aircraft
+    model, one model per worker process, and stores them in the seat_configs table.
+    """
+    route_stats = {
+        destination: stats
+        for destination, (_, stats) in route_store.load_hub_route_stats(hub, destinations).items()
+    }
+    if not route_stats:
+        raise Exception(f"No extracted routes for HUB {hub}")
+    aircraft = load_all_aircraft()
+    if models:
+        aircraft = aircraft[aircraft["model"].str.lower().isin([m.lower() for m in models])]
+
+    timestamp = time.time()
+    results = []
+    # Route stats are read once here and shipped to the workers, which only run numpy
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(solve_model, row, route_stats, no_negative): (row["make"], row["model"])
+            for _, row in aircraft.iterrows()
+        }
+        for future in as_completed(futures):
+            make, model = futures[future]
+            if future.exception():
+                print(f"{make} {model}: {future.exception()}")
+                continue
+            df, errors = future.result()
+            save_seat_configs(hub, make, model, df, timestamp)
+            print(
+                f"{make} {model}: {df['destination'].nunique()} routes configured, {len(errors)} skipped"
+            )
+            df.insert(1, "make", make)
+            df.insert(2, "model", model)
+            results.append(df)
+    return pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "hub", help="Enter HUB name you need to compute all seat configs for eg: CGK"
+    )
+    parser.add_argument(
+        "--destinations",
+        "-d",
+        help="List of destination airport code (comma seperated) (Default: all extracted)",
+    )
+    parser.add_argument(
+        "--models",
+        "-a",
+        help=f"List of aircraft models (comma seperated) (Default: all in {AIRCRAFT_DATA})",
+    )
+    parser.add_argument(
+        "--workers", "-w", type=int, help="Number of solver processes (Default: CPU count)"
+    )
+    parser.add_argument(
+        "--allow_negative",
+        action="store_true",
+        help="Allow configuring more seats than the route's demand (create_and_schedule_route.py never does)",
+    )
+    args = parser.parse_args()
+    df = batch_seat_configs(
+        args.hub,
+        args.destinations.split(",") if args.destinations else None,
+        args.models.split(",") if args.models else None,
+        args.workers,
+        not args.allow_negative,
+    )
+    if df.empty:
+        sys.exit("No seat configs computed")
+    best = df[df["note"] == "Best Turnover"].sort_values(by="total_turnover", ascending=False)
+    pd.set_option("display.max_rows", None)
+    print(best[["destination", "make", "model", "no", "total_turnover", "roi"]])
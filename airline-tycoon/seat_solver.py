@@ -0,0 +1,185 @@
+import argparse
+import math
+import os
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from route_types import RouteStats
+from seat import WaveStat, read_route_stats, seat_configs_df
+
+# make,model,seats,range,speed,price - one row per aircraft model, as listed in Airline Tycoon
+AIRCRAFT_DATA = os.getenv("TYCOON_AIRCRAFT_DATA", "aircraft.csv")
+
+CLASSES = ["economy", "business", "first", "cargo"]
+# Cabin space taken by one seat (or cargo unit) of each class, in economy seats
+CLASS_SIZE = np.array([1.0, 1.8, 4.2, 1.0])
+TURNAROUND_HOURS = 1.0
+WEEK_HOURS = 7 * 24
+MAX_WAVES = 9
+
+
+def load_aircraft(make: str, model: str, path: str = AIRCRAFT_DATA) -> pd.Series:
+    if not os.path.exists(path):
+        raise Exception(
+            f"Can't find aircraft data at {path}, run aircraft_data.py to scrape it from the buy pages"
+        )
+    aircraft = pd.read_csv(path)
+    match = aircraft[
+        (aircraft["make"].str.lower() == make.lower())
+        & (aircraft["model"].str.lower() == model.lower())
+    ]
+    if match.empty:
+        raise Exception(f"No aircraft data for {make} {model} in {path}")
+    return match.iloc[0]
+
+
+def class_values(route_stats: RouteStats, field: str) -> np.ndarray:
+    return np.array(
+        [
+            float(getattr(getattr(route_stats, c), field) or 0) if getattr(route_stats, c) else 0.0
+            for c in CLASSES
+        ]
+    )
+
+
+def rotations_per_week(distances: List[int], speed: float) -> int:
+    # One rotation flies every leg of the circuit out and back
+    hours = sum(2 * (distance / speed + TURNAROUND_HOURS) for distance in distances)
+    return int(WEEK_HOURS // hours)
+
+
+def solve_waves(
+    demand: np.ndarray,
+    price: np.ndarray,
+    seats: float,
+    rotations: int,
+    no_negative=False,
+    max_waves: int = MAX_WAVES,
+) -> np.ndarray:
+    """
+    Seat config for 1..max_waves aircraft sharing the route, as a (waves x classes) array.
+
+    demand/price are (legs x classes) daily figures. Each aircraft gets an equal share of
+    the weekly demand per flight, and the cabin is filled greedily by revenue per unit of
+    cabin space - the LP optimum of this knapsack, rounded down to whole seats.
+    """
+    waves = np.arange(1, max_waves + 1)[:, None]
+    # Per flight demand of the tightest leg, for every wave count at once
+    per_flight = demand.min(axis=0)[None, :] * 7 / (waves * rotations)
+    caps = np.floor(per_flight) if no_negative else np.ceil(per_flight)
+
+    config = np.zeros((max_waves, len(CLASSES)))
+    space = np.full(max_waves, float(seats))
+    for c in np.argsort(-price.mean(axis=0) / CLASS_SIZE):
+        config[:, c] = np.minimum(caps[:, c], np.floor(space / CLASS_SIZE[c]))
+        space -= config[:, c] * CLASS_SIZE[c]
+    return config
+
+
+def seat_config_from_stats(
+    route_stats: List[RouteStats],
+    aircraft: pd.Series,
+    no_negative=False,
+    show=True,
+) -> pd.DataFrame:
+    """WaveStat rows for a circuit of routes flown by one aircraft model."""
+    distances = [stats.distance for stats in route_stats]
+    if max(distances) > aircraft["range"]:
+        raise Exception(
+            f"{aircraft['make']} {aircraft['model']} range {aircraft['range']} is short of {max(distances)}"
+        )
+
+    demand = np.array([class_values(stats, "demand") for stats in route_stats])
+    price = np.array([class_values(stats, "price") for stats in route_stats])
+    rotations = rotations_per_week(distances, aircraft["speed"])
+    if rotations == 0:
+        raise Exception(f"Circuit of {sum(distances)} is too long to fly weekly")
+
+    config = solve_waves(demand, price, aircraft["seats"], rotations, no_negative)
+    # Revenue per aircraft per week: every leg is flown out and back on each rotation,
+    # selling at most each aircraft's share of the leg's demand per flight
+    waves = np.arange(1, len(config) + 1)[:, None, None]
+    per_flight = demand[None, :, :] * 7 / (waves * rotations)
+    turnover_per_wave = rotations * 2 * (
+        np.minimum(config[:, None, :], per_flight) * price[None, :, :]
+    ).sum(axis=(1, 2))
+    used_space = (config * CLASS_SIZE).sum(axis=1)
+
+    wave_stats = []
+    for i, wave in enumerate(range(1, len(config) + 1)):
+        if config[i].sum() == 0:
+            break
+        daily = turnover_per_wave[i] / 7
+        wave_stats.append(
+            WaveStat(
+                no=wave,
+                economy=int(config[i][0]),
+                business=int(config[i][1]),
+                first=int(config[i][2]),
+                cargo=int(config[i][3]),
+                turnover_per_wave=turnover_per_wave[i],
+                roi=round(turnover_per_wave[i] * 52 / aircraft["price"] * 100, 2)
+                if aircraft["price"]
+                else 0.0,
+                total_turnover=turnover_per_wave[i] * wave,
+                turnover_days=math.ceil(aircraft["price"] / daily) if daily else 0,
+                max_configured=f"{used_space[i]:.0f}/{aircraft['seats']}",
+            )
+        )
+    return seat_configs_df(wave_stats, show)
+
+
+def solve_seat_config(
+    source: str,
+    destinations: List[str],
+    aircraft_make: str,
+    aircraft_model: str,
+    no_negative=False,
+) -> pd.DataFrame:
+    """Offline stand-in for seat.find_seat_config, returns the same WaveStat rows."""
+    return seat_config_from_stats(
+        [read_route_stats(source, destination) for destination in destinations],
+        load_aircraft(aircraft_make, aircraft_model),
+        no_negative,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "hub", help="Enter HUB name you need to compute seat configs for eg: CGK"
+    )
+    parser.add_argument(
+        "destinations",
+        help="""
+            List of destination airport code (comma seperated)
+            eg: TFS,ZRH,AGP,CPH,ARN,GVA
+        """,
+    )
+    parser.add_argument(
+        "--aircraft_make",
+        "-m",
+        help="Aircraft maker name as per Airline Tycoon",
+        default="Airbus",
+    )
+    parser.add_argument(
+        "--aircraft_model",
+        "-a",
+        help="Aircraft model name for the Aircraft maker",
+        default="A380-800",
+    )
+    parser.add_argument(
+        "--no_negative",
+        action="store_true",
+        help="Never configure more seats than the route's demand",
+    )
+    args = parser.parse_args()
+    solve_seat_config(
+        args.hub,
+        args.destinations.split(","),
+        args.aircraft_make,
+        args.aircraft_model,
+        args.no_negative,
+    )
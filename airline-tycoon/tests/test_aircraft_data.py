@@ -0,0 +1,30 @@
+import os
+
+from lxml import html
+
+from aircraft_data import parse_aircraft_list
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def test_parse_aircraft_list():
+    with open(os.path.join(FIXTURES, "buy_boeing.html"), "rb") as f:
+        page = html.fromstring(f.read())
+    assert parse_aircraft_list(page, "Boeing") == [
+        {
+            "make": "Boeing",
+            "model": "747-400",
+            "seats": 416,
+            "range": 13450,
+            "speed": 913,
+            "price": 230456000,
+        },
+        {
+            "make": "Boeing",
+            "model": "737-800",
+            "seats": 189,
+            "range": 5436,
+            "speed": 842,
+            "price": 62125000,
+        },
+    ]
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import threading
+
+from aiohttp import web
+
+import route_store
+from route_types import RouteStats
+from route_async import extract_hub_routes_async
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+HUB_ID = 2871234
+
+# Path -> fixture the stub tycoon server answers with once logged in
+PAGES = {
+    f"/network/showhub/{HUB_ID}/linelist": "linelist.html",
+    "/network/showline/5102771": "route.html",
+    "/network/showline/5102772": "route_no_category.html",
+    "/marketing/pricing/5102771": "route_prices.html",
+    "/marketing/pricing/5102772": "route_prices.html",
+}
+
+
+def fixture_response(name: str) -> web.Response:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return web.Response(body=f.read(), content_type="text/html")
+
+
+def stub_app(requests: list, logins: list) -> web.Application:
+    async def network(request):
+        requests.append(request.path)
+        if request.cookies.get("session") != "ok":
+            return fixture_response("login.html")
+        return fixture_response("network.html")
+
+    async def login_check(request):
+        logins.append(dict(await request.post()))
+        response = web.HTTPFound("/network/")
+        response.set_cookie("session", "ok")
+        raise response
+
+    async def page(request):
+        requests.append(request.path)
+        if request.cookies.get("session") != "ok":
+            raise web.HTTPForbidden()
+        return fixture_response(PAGES[request.path])
+
+    app = web.Application()
+    app.router.add_get("/network/", network)
+    app.router.add_post("/login_check", login_check)
+    for path in PAGES:
+        app.router.add_get(path, page)
+    return app
+
+
+async def run_against_stub(requests: list, logins: list, **kwargs):
+    runner = web.AppRunner(stub_app(requests, logins))
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        # By host name, aiohttp's cookie jar drops cookies set by a bare IP address
+        return await extract_hub_routes_async(
+            "CGK", "ALL", base_url=f"http://localhost:{port}", **kwargs
+        )
+    finally:
+        await runner.cleanup()
+
+
+def test_extract_hub_routes_async(tmp_path, monkeypatch):
+    # Route stats land in tmp/route_stats.db under the working directory, on a fresh connection
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(route_store, "_local", threading.local())
+    monkeypatch.setenv("TYCOON_EMAIL", "pilot@example.com")
+    monkeypatch.setenv("TYCOON_PASSWORD", "secret")
+
+    requests, logins = [], []
+    failed = asyncio.run(run_against_stub(requests, logins, concurrency=2, rate=0))
+
+    assert failed == []
+    assert logins == [
+        {
+            "_csrf_token": "a1b2c3",
+            "_username": "pilot@example.com",
+            "_password": "secret",
+        }
+    ]
+    sin = route_store.load_route_stats("CGK", "SIN")
+    assert (sin.category, sin.distance) == (7, 1884)
+    assert (sin.economy.price, sin.economy.remaining_demand) == (1254, 1045)
+    dps = route_store.load_route_stats("CGK", "DPS")
+    assert (dps.category, dps.distance) == (None, 983)
+    # The login form, the login's redirect back and the hub lookup are the only network pages,
+    # then each route and its prices are fetched once
+    assert sorted(requests) == sorted(["/network/"] * 3 + list(PAGES))
+
+
+def test_extract_hub_routes_async_skips_extracted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(route_store, "_local", threading.local())
+    monkeypatch.setenv("TYCOON_EMAIL", "pilot@example.com")
+    monkeypatch.setenv("TYCOON_PASSWORD", "secret")
+    route_store.save_route_stats("CGK", "SIN", RouteStats(distance=1884))
+
+    requests = []
+    assert asyncio.run(run_against_stub(requests, [], rate=0)) == []
+    assert "/network/showline/5102771" not in requests
+    assert "/network/showline/5102772" in requests
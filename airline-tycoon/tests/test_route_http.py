@@ -0,0 +1,125 @@
+import os
+
+import pytest
+from lxml import html
+
+from route_types import RouteStat, RouteStats
+from route_http import (
+    get_route_stats,
+    parse_destinations,
+    parse_distance,
+    parse_hub_id,
+    parse_max_category,
+    parse_route_prices,
+    route_url,
+)
+
+# Trimmed pages with the markup the parsers rely on, the linePicker options carry the same
+# "HUB - DESTINATION" text the Selenium backend selects by
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASE_URL = "https://tycoon.airlines-manager.com"
+
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+def load_page(name: str, url: str = "/network/"):
+    return html.fromstring(read_fixture(name), base_url=BASE_URL + url)
+
+
+class StubResponse:
+    def __init__(self, url: str, content: bytes):
+        self.url = url
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class StubSession:
+    """Serves fixtures by URL in place of requests.Session, recording every URL fetched."""
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.fetched = []
+
+    def get(self, url: str):
+        self.fetched.append(url)
+        return StubResponse(url, read_fixture(self.pages[url]))
+
+
+def test_parse_hub_id():
+    page = load_page("network.html")
+    assert parse_hub_id(page, "CGK") == 2871234
+    assert parse_hub_id(page, "SIN") == 2871299
+
+
+def test_parse_hub_id_unknown_hub():
+    assert parse_hub_id(load_page("network.html"), "DPS") is None
+
+
+def test_parse_destinations():
+    page = load_page("linelist.html", "/network/showhub/2871234/linelist")
+    assert parse_destinations(page, "CGK") == ["SIN", "DPS"]
+    assert parse_destinations(page, "SIN") == ["HKG"]
+
+
+@pytest.mark.parametrize(
+    "route_text, url",
+    [
+        ("CGK - SIN", f"{BASE_URL}/network/showline/5102771"),
+        ("CGK - DPS", f"{BASE_URL}/network/showline/5102772"),
+        ("SIN - HKG", f"{BASE_URL}/network/showline/5102773"),
+    ],
+)
+def test_route_url(route_text, url):
+    assert route_url(load_page("network.html"), route_text) == url
+
+
+def test_route_url_unknown_route():
+    with pytest.raises(Exception, match="Can't find route CGK - HKG"):
+        route_url(load_page("network.html"), "CGK - HKG")
+
+
+def test_parse_max_category_and_distance():
+    page = load_page("route.html", "/network/showline/5102771")
+    assert parse_max_category(page) == 7
+    assert parse_distance(page) == 1884
+
+
+def test_parse_max_category_missing():
+    page = load_page("route_no_category.html", "/network/showline/5102772")
+    assert parse_max_category(page) is None
+    assert parse_distance(page) == 983
+
+
+def test_parse_route_prices():
+    page = load_page("route_prices.html", "/marketing/pricing/5102771")
+    route_stats = parse_route_prices(page, RouteStats(category=7, distance=1884))
+    assert route_stats == RouteStats(
+        economy=RouteStat(price="1254", demand="3120", remaining_demand="1045"),
+        business=RouteStat(price="3902", demand="412", remaining_demand="0"),
+        first=RouteStat(price="8110", demand="98", remaining_demand="98"),
+        cargo=RouteStat(price="512", demand="1500", remaining_demand="620"),
+        category=7,
+        distance=1884,
+    )
+
+
+def test_get_route_stats():
+    # Looked up by the same "HUB - DESTINATION" text route.extract_route_price_stats passes
+    session = StubSession(
+        {
+            f"{BASE_URL}/network/showline/5102771": "route.html",
+            f"{BASE_URL}/marketing/pricing/5102771": "route_prices.html",
+        }
+    )
+    route_stats = get_route_stats(session, load_page("network.html"), "CGK - SIN")
+    assert route_stats.category == 7
+    assert route_stats.distance == 1884
+    assert route_stats.economy == RouteStat(price="1254", demand="3120", remaining_demand="1045")
+    assert route_stats.cargo == RouteStat(price="512", demand="1500", remaining_demand="620")
+    # The network page is passed in, only the route and its prices are fetched
+    assert session.fetched == list(session.pages)
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, List, Tuple, Union
+
+import pandas as pd
+from selenium.common.exceptions import (
+    ElementClickInterceptedException,
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+)
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+DEFAULT_TIMEOUT = float(os.getenv("TYCOON_WAIT_TIMEOUT", "30"))
+POLL_FREQUENCY = 0.1
+
+Locator = Tuple[str, str]
+
+# Both sites load their widgets with jQuery, idle means no request in flight
+NETWORK_IDLE_SCRIPT = """
+return document.readyState === "complete"
+    && (typeof window.jQuery === "undefined" || window.jQuery.active === 0);
+"""
+
+
+@dataclass
+class WaitTiming:
+    name: str
+    seconds: float
+    timed_out: bool
+
+
+timings: List[WaitTiming] = []
+_timings_lock = threading.Lock()
+
+
+def until(
+    driver: WebDriver,
+    condition: Callable[[WebDriver], Any],
+    name: str,
+    timeout: float = None,
+) -> Any:
+    """
+    Polls condition(driver) until it returns something truthy and returns it, raising
+    TimeoutException after `timeout` seconds. Every wait is recorded in `timings`.
+    """
+    start = time.perf_counter()
+    timed_out = False
+    try:
+        return WebDriverWait(
+            driver,
+            DEFAULT_TIMEOUT if timeout is None else timeout,
+            poll_frequency=POLL_FREQUENCY,
+            ignored_exceptions=(NoSuchElementException, StaleElementReferenceException),
+        ).until(condition, f"Timed out waiting for {name}")
+    except TimeoutException:
+        timed_out = True
+        raise
+    finally:
+        with _timings_lock:
+            timings.append(WaitTiming(name, time.perf_counter() - start, timed_out))
+
+
+def present(driver: WebDriver, locator: Locator, timeout: float = None) -> WebElement:
+    return until(driver, EC.presence_of_element_located(locator), f"{locator[1]} present", timeout)
+
+
+def all_present(driver: WebDriver, locator: Locator, timeout: float = None) -> List[WebElement]:
+    return until(
+        driver, EC.presence_of_all_elements_located(locator), f"all {locator[1]} present", timeout
+    )
+
+
+def clickable(
+    driver: WebDriver, target: Union[Locator, WebElement], timeout: float = None
+) -> WebElement:
+    name = target[1] if isinstance(target, tuple) else target.tag_name
+    return until(driver, EC.element_to_be_clickable(target), f"{name} clickable", timeout)
+
+
+def click(driver: WebDriver, target: Union[Locator, WebElement], timeout: float = None):
+    """Clicks as soon as nothing overlays the element, instead of retrying on a fixed delay."""
+    element = clickable(driver, target, timeout)
+
+    def clicked(_):
+        try:
+            element.click()
+            return True
+        except ElementClickInterceptedException:
+            return False
+
+    until(driver, clicked, f"{element.tag_name} click", timeout)
+
+
+def value_equals(
+    driver: WebDriver, element: WebElement, value: str, timeout: float = None
+) -> WebElement:
+    return until(
+        driver,
+        lambda _: element if element.get_attribute("value") == value else False,
+        f"{element.get_attribute('id') or element.tag_name} == {value}",
+        timeout,
+    )
+
+
+def text_changed(
+    driver: WebDriver, locator: Locator, old_text: str, timeout: float = None
+) -> WebElement:
+    def changed(d):
+        element = d.find_element(*locator)
+        return element if element.text != old_text else False
+
+    return until(driver, changed, f"{locator[1]} text changed", timeout)
+
+
+def network_idle(driver: WebDriver, timeout: float = None):
+    until(driver, lambda d: d.execute_script(NETWORK_IDLE_SCRIPT), "network idle", timeout)
+
+
+def timings_df() -> pd.DataFrame:
+    with _timings_lock:
+        df = pd.DataFrame(timings, columns=["name", "seconds", "timed_out"])
+    return (
+        df.groupby("name")
+        .agg(
+            count=("seconds", "size"),
+            total=("seconds", "sum"),
+            max=("seconds", "max"),
+            timed_out=("timed_out", "sum"),
+        )
+        .sort_values(by="total", ascending=False)
+    )
+
+
+def print_timings():
+    if timings:
+        print(f"Waited {sum(t.seconds for t in timings):.1f}s in {len(timings)} waits:")
+        print(timings_df().round(2))
@@ -0,0 +1,139 @@
+#!/bin/python
+import argparse
+import json
+import resource
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing import Process
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import export_data_to_csv
+from bench_row_builder import canned_fields, canned_hits
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def fake_es_handler(fields, total_hits, page_size, latency, es_version='2.4.6'):
+    """Serves just enough of the ES API for scroll_timeframe: info, mapping, scan search and scroll pages."""
+    mapping = {export_data_to_csv.INDEX_NAME: {'mappings': {export_data_to_csv.INDEX_MAPPING_NAME: {
+        'properties': dict((field['name'], {'type': field['type']}) for field in fields)
+    }}}}
+    # Pages are serialized once up front so the server doesn't compete with the exporter for CPU
+    page_hits = json.dumps(canned_hits(fields, page_size))[1:-1]
+    scrolls = {}
+
+    class FakeElasticsearch(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def respond(self, body):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('X-Elastic-Product', 'Elasticsearch')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def scroll_id(self, url, body):
+            if 'scroll_id' in parse_qs(url.query):
+                return parse_qs(url.query)['scroll_id'][0]
+            try:
+                return json.loads(body)['scroll_id']
+            except ValueError:
+                return body.decode()
+
+        def page(self, sid, size):
+            hits = page_hits if size == page_size else json.dumps(canned_hits(fields, size))[1:-1]
+            return '{{"_scroll_id": "{0}", "hits": {{"total": {1}, "hits": [{2}]}}}}'.format(sid, total_hits, hits).encode()
+
+        def handle_request(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if url.path.endswith('/_search/scroll'):
+                sid = self.scroll_id(url, body)
+                if self.command == 'DELETE':
+                    scrolls.pop(sid, None)
+                    return self.respond(b'{"succeeded": true}')
+                size = min(page_size, scrolls.get(sid, 0))
+                scrolls[sid] = scrolls.get(sid, 0) - size
+                return self.respond(self.page(sid, size))
+            if url.path.endswith('/_search'):
+                sid = 'scroll-{0}'.format(len(scrolls))
+                scrolls[sid] = total_hits
+                return self.respond(self.page(sid, 0))
+            if url.path == '/':
+                return self.respond(json.dumps({'version': {'number': es_version}}).encode())
+            return self.respond(json.dumps(mapping).encode())
+
+        do_GET = do_POST = do_DELETE = handle_request
+
+    return FakeElasticsearch
+
+
+def serve(port, fields, total_hits, page_size, latency):
+    ThreadingHTTPServer(('127.0.0.1', port), fake_es_handler(fields, total_hits, page_size, latency)).serve_forever()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux; sliced exports run in child processes
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    ) / 1024.0
+
+
+def report(stats, elapsed):
+    stage_seconds = stats['fetch_seconds'] + stats['transform_seconds'] + stats['write_seconds']
+    print("rows:            {0:,}".format(stats['rows']))
+    print("rows/sec:        {0:,.0f}".format(stats['rows'] / elapsed))
+    print("bytes written:   {0:,}".format(stats['bytes']))
+    print("peak RSS:        {0:,.1f} MB".format(peak_rss_mb()))
+    for stage in ('fetch', 'transform', 'write'):
+        seconds = stats[stage + '_seconds']
+        print("{0:<16} {1:8.2f}s ({2:.0%})".format(stage + ':', seconds, seconds / max(stage_seconds, 1e-6)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9299, help="Port for the fake Elasticsearch (Default: 9299)")
+    parser.add_argument("--columns", type=int, default=40, help="No. of mapped fields (Default: 40)")
+    parser.add_argument("--hits", type=int, default=200000, help="Total hits in the exported day (Default: 200000)")
+    parser.add_argument("--page_size", type=int, default=1000, help="Hits per scroll page (Default: 1000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of delay per ES response (Default: 0)")
+    parser.add_argument("--slices", type=int, default=1, help="Run export() with N parallel slices (Default: 1)")
+    parser.add_argument("--format", choices=export_data_to_csv.OUTPUT_FORMATS, default='csv', help="Output format (Default: csv)")
+    args = parser.parse_args()
+
+    fields = canned_fields(args.columns)
+    server = Process(target=serve, args=(args.port, fields, args.hits, args.page_size, args.latency))
+    server.daemon = True
+    server.start()
+    time.sleep(0.5)
+
+    export_dir = tempfile.mkdtemp(prefix='es_export_bench')
+    export_data_to_csv.ES_HOSTS = ['127.0.0.1:{0}'.format(args.port)]
+    export_data_to_csv.LOCAL_EXPORT_PATH = export_dir
+    try:
+        started = time.time()
+        day = datetime(2020, 1, 1)
+        if args.slices > 1:
+            # The fake server ignores the time range, so every slice returns --hits documents
+            stats = export_data_to_csv.export(
+                args.slices, start_date=day, checkpoint_file=export_dir + '/checkpoint.json', output_format=args.format)
+        else:
+            stats = export_data_to_csv.new_stats()
+            export_data_to_csv.scroll_timeframe(
+                day, datetime(2020, 1, 1, 23, 59, 59), stats=stats, output_format=args.format)
+        report(stats, time.time() - started)
+    finally:
+        shutil.rmtree(export_dir)
+        server.terminate()
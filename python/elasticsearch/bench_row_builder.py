@@ -0,0 +1,63 @@
+#!/bin/python
+import argparse
+import json
+import random
+import time
+
+from export_data_to_csv import fast_json, hits_to_rows, make_row_builder
+
+
+def canned_fields(columns):
+    types_cycle = ['keyword', 'long', 'double', 'date', 'boolean']
+    return [{'name': 'field_{0}'.format(i), 'type': types_cycle[i % len(types_cycle)]} for i in range(columns)]
+
+
+def canned_hits(fields, hits):
+    random.seed(42)
+    data = []
+    for i in range(hits):
+        source = {}
+        for field in fields:
+            if random.random() < 0.1:
+                continue
+            source[field['name']] = {
+                'keyword': 'value-{0}'.format(random.randint(0, 1000)),
+                'long': random.randint(0, 1 << 40),
+                'double': random.random() * 1000,
+                'date': '2020-01-01T00:00:{0:02d}Z'.format(i % 60),
+                'boolean': random.random() < 0.5,
+            }[field['type']]
+        data.append({'_id': str(i), '_source': source})
+    return data
+
+
+def canned_response(fields, hits):
+    return json.dumps({'_scroll_id': 'bench', 'hits': {'total': hits, 'hits': canned_hits(fields, hits)}})
+
+
+def bench(name, loads, build_rows, body, repeat):
+    rows = 0
+    started = time.time()
+    for _ in range(repeat):
+        rows += len(build_rows(loads(body)['hits']['hits']))
+    elapsed = time.time() - started
+    print("{0:<28} {1:>12,.0f} rows/sec".format(name, rows / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--columns", type=int, default=40, help="No. of mapped fields per hit (Default: 40)")
+    parser.add_argument("--hits", type=int, default=1000, help="No. of hits per scroll page (Default: 1000)")
+    parser.add_argument("--repeat", type=int, default=50, help="No. of times each page is decoded (Default: 50)")
+    args = parser.parse_args()
+
+    fields = canned_fields(args.columns)
+    body = canned_response(fields, args.hits)
+    compiled = make_row_builder(fields)
+
+    bench("json + hits_to_rows", json.loads, lambda data: hits_to_rows(data, fields), body, args.repeat)
+    bench("json + compiled builder", json.loads, compiled, body, args.repeat)
+    if fast_json is not None:
+        bench("{0} + compiled builder".format(fast_json.__name__), fast_json.loads, compiled, body, args.repeat)
+    else:
+        print("orjson/ujson not installed, skipping fast JSON decoding")
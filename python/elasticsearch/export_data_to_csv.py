@@ -1,19 +1,86 @@
 #!/bin/python
+import abc
+import argparse
 import calendar
 import os
 import csv
+import gzip
+import hashlib
+import io
+import json
+import threading
+import time
+from multiprocessing import Pool
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionError as ESConnectionError, TransportError
+from elasticsearch.serializer import JSONSerializer
 from datetime import datetime, timedelta
+from queue import Empty, Full, Queue
+
+try:
+    import orjson as fast_json
+except ImportError:
+    try:
+        import ujson as fast_json
+    except ImportError:
+        fast_json = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 LOCAL_EXPORT_PATH = '/tmp/es_export'
 ES_HOSTS = ['localhost:9200']
 INDEX_NAME = 'es_index'
 INDEX_MAPPING_NAME = 'index_map_to_export'
 TIME_FIELD = "time_created"
+FLUSH_SIZE = 10000
+# gzip/zstd level for compressed outputs, gzip's default of 9 makes the write stage the bottleneck
+COMPRESS_LEVEL = 3
+QUEUE_SIZE = 4
+CHECKPOINT_FILE = LOCAL_EXPORT_PATH + '/checkpoint.json'
+# Unsliced days are scrolled in this many consecutive windows, each one a resume point
+DAY_CHUNKS = 24
+TEXTFILE_COLLECTOR_PATH = '/opt/node_exporter-0.14.0.linux-amd64/textfile_collector'
+SCROLL_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+INCREMENTAL_STATE_FILE = LOCAL_EXPORT_PATH + '/incremental_state.json'
+PAGE_SIZE = 1000
+SCHEMA_TTL = 3600
+ES_POOL_SIZE = 10
+ES_TIMEOUT = 60
+SCROLL_RETRIES = 5
+RETRY_BACKOFF = 1
+DOCVALUE_TYPES = ['long', 'integer', 'short', 'byte', 'double', 'float', 'half_float', 'scaled_float', 'date']
 
 
 def dt_to_timestamp(dt):
-    return str(calendar.timegm(dt.timetuple()) * 1000)
+    return str(calendar.timegm(dt.timetuple()) * 1000 + dt.microsecond // 1000)
+
+
+def split_timeframe(gte_timestamp, lte_timestamp, parts):
+    # Sub-windows are contiguous and non-overlapping, each ending 1ms before the next one starts
+    step = (lte_timestamp - gte_timestamp + timedelta(seconds=1)) // parts
+    windows = []
+    for part in range(parts):
+        start = gte_timestamp + step * part
+        end = lte_timestamp if part == parts - 1 else start + step - timedelta(milliseconds=1)
+        windows.append({"gte": start, "lte": end})
+    return windows
+
+
+def day_filename(day, output_format='csv'):
+    return LOCAL_EXPORT_PATH + "/{0}_{1}.{2}".format(INDEX_MAPPING_NAME, day.strftime('%Y-%m-%d'), output_format)
+
+
+def part_filename(day, part, output_format='csv'):
+    return LOCAL_EXPORT_PATH + "/{0}_{1}_part{2:03d}.{3}".format(INDEX_MAPPING_NAME, day.strftime('%Y-%m-%d'), part, output_format)
 
 
 def create_directory(dir):
@@ -21,92 +88,961 @@ def create_directory(dir):
         os.makedirs(dir)
 
 
-def get_fields(es):
+def flatten_properties(properties, prefix=''):
+    # object/nested fields become dotted leaf paths, eg: user.address.city
     fields = []
-    index_info = es.indices.get(INDEX_NAME)
-    for field_name, field_info in index_info[INDEX_NAME]['mappings'][INDEX_MAPPING_NAME]['properties'].iteritems():
-        fields.append({
-            'name': field_name,
-            'type': field_info['type']
-        })
+    for field_name, field_info in sorted(properties.items()):
+        if 'properties' in field_info:
+            fields.extend(flatten_properties(field_info['properties'], prefix + field_name + '.'))
+        else:
+            fields.append({
+                'name': prefix + field_name,
+                'type': field_info.get('type', 'object')
+            })
+    return fields
+
+
+def schema_filename():
+    return LOCAL_EXPORT_PATH + "/schema_{0}_{1}.json".format(INDEX_NAME, INDEX_MAPPING_NAME)
+
+
+def get_fields(es):
+    """Field list from the index mapping, cached on disk and only revalidated every SCHEMA_TTL seconds.
+
+    Revalidation fetches just the type mapping. If it changed, existing columns keep their
+    position and new ones are appended, so column order stays stable across export files.
+    """
+    cached = load_checkpoint(schema_filename())
+    if cached and time.time() - cached['checked'] < SCHEMA_TTL:
+        return cached['fields']
+
+    mapping = with_retries(es.indices.get_mapping, index=INDEX_NAME, doc_type=INDEX_MAPPING_NAME)
+    properties = mapping[INDEX_NAME]['mappings'][INDEX_MAPPING_NAME]['properties']
+    mapping_hash = hashlib.md5(json.dumps(properties, sort_keys=True).encode()).hexdigest()
+
+    if cached and cached['mapping_hash'] == mapping_hash:
+        fields = cached['fields']
+    else:
+        latest = dict((field['name'], field) for field in flatten_properties(properties))
+        previous = [field['name'] for field in cached.get('fields', []) if field['name'] in latest]
+        fields = [latest[name] for name in previous] + [field for name, field in sorted(latest.items()) if name not in previous]
+        if cached:
+            print("Mapping for {0}/{1} changed, {2} fields".format(INDEX_NAME, INDEX_MAPPING_NAME, len(fields)))
+
+    create_directory(LOCAL_EXPORT_PATH)
+    save_checkpoint({'mapping_hash': mapping_hash, 'fields': fields, 'checked': time.time()}, schema_filename())
     return fields
 
 
-def add_headers(fields, filename):
-    with open(filename, 'w+') as csvfile:
-        data_csv = csv.writer(csvfile, delimiter=',', lineterminator='\n', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        rowData = []
+def open_text(filename, mode, output_format):
+    """Opens a text stream for csv/ndjson output, compressed according to the format's suffix."""
+    if output_format.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(filename, mode + 'b', compresslevel=COMPRESS_LEVEL), newline='')
+    if output_format.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError("zstandard is required for {0} output".format(output_format))
+        if mode in ('w', 'a'):
+            stream = zstandard.ZstdCompressor(level=COMPRESS_LEVEL).stream_writer(open(filename, mode + 'b'))
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'))
+        return io.TextIOWrapper(stream, newline='')
+    return open(filename, mode, newline='')
+
+
+class ExportWriter(abc.ABC):
+    """Keeps one export file open and writes buffered rows in batches of flush_size."""
+
+    def __init__(self, filename, fields, flush_size=FLUSH_SIZE, append=False):
+        self.filename = filename
+        self.fields = fields
+        self.flush_size = flush_size
+        self.append = append
+        self.buffer = []
+        self.rows = 0
+        self.bytes = 0
+        self.started = time.time()
+        self.open()
+
+    @abc.abstractmethod
+    def open(self):
+        pass
+
+    @abc.abstractmethod
+    def write_rows(self, rows):
+        pass
+
+    @abc.abstractmethod
+    def finish(self):
+        pass
+
+    def add_rows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write_rows(self.buffer)
+            self.rows += len(self.buffer)
+            self.buffer = []
+        self.bytes = os.path.getsize(self.filename)
+
+    def close(self):
+        self.flush()
+        self.finish()
+        self.bytes = os.path.getsize(self.filename)
+
+    def rows_per_sec(self):
+        return self.rows / max(time.time() - self.started, 1e-6)
+
+    def bytes_per_sec(self):
+        return self.bytes / max(time.time() - self.started, 1e-6)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvWriter(ExportWriter):
+    def __init__(self, filename, fields, flush_size=FLUSH_SIZE, output_format='csv', append=False):
+        self.output_format = output_format
+        super(CsvWriter, self).__init__(filename, fields, flush_size, append)
+
+    def open(self):
+        # Compressed outputs append as a new gzip member / zstd frame, both still one valid stream
+        self.csvfile = open_text(self.filename, 'a' if self.append else 'w', self.output_format)
+        self.data_csv = csv.writer(self.csvfile, delimiter=',', lineterminator='\n', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        if not self.append:
+            self.data_csv.writerow([field['name'] for field in self.fields])
+
+    def write_rows(self, rows):
+        self.data_csv.writerows(rows)
+        self.csvfile.flush()
+
+    def finish(self):
+        self.csvfile.close()
+
+
+class NdjsonWriter(CsvWriter):
+    def open(self):
+        self.names = [field['name'] for field in self.fields]
+        self.csvfile = open_text(self.filename, 'a' if self.append else 'w', self.output_format)
+
+    def write_rows(self, rows):
+        self.csvfile.write(''.join(json.dumps(dict(zip(self.names, row))) + '\n' for row in rows))
+        self.csvfile.flush()
+
+
+# ES mapping type -> parquet column type; anything else (keyword, text, date, ...) is kept as a string
+PARQUET_TYPES = {
+    'long': 'int64',
+    'integer': 'int64',
+    'short': 'int64',
+    'byte': 'int64',
+    'double': 'float64',
+    'float': 'float64',
+    'half_float': 'float64',
+    'scaled_float': 'float64',
+    'boolean': 'bool_',
+}
+
+
+def coerce_value(value, column_type):
+    """Best effort conversion of a _source value to a parquet column type, None if it doesn't fit.
+
+    _source keeps whatever the client indexed: numbers as strings, floats in long fields and
+    single values wrapped in arrays are all common.
+    """
+    if isinstance(value, (list, tuple)):
+        if len(value) != 1:
+            return None
+        value = value[0]
+    if value is None:
+        return None
+    try:
+        if column_type == pa.int64():
+            number = int(value) if isinstance(value, str) and value.lstrip('-').isdigit() else float(value)
+            if isinstance(number, float):
+                if not number.is_integer():
+                    return None
+                number = int(number)
+            return number if -2 ** 63 <= number < 2 ** 63 else None
+        if column_type == pa.float64():
+            return float(value)
+        if column_type == pa.bool_():
+            if isinstance(value, str):
+                return {'true': True, 'false': False}.get(value.lower())
+            return bool(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return value
+
+
+class ParquetWriter(ExportWriter):
+    """Writes one parquet row group per flush, typed from the index mapping.
+
+    Values that don't fit their column's type are coerced, or written as null and counted in
+    self.dropped, rather than failing the export.
+    """
+
+    def open(self):
+        if pa is None:
+            raise ValueError("pyarrow is required for parquet output")
+        if self.append:
+            raise ValueError("parquet files can't be appended to")
+        self.schema = pa.schema([
+            (field['name'], getattr(pa, PARQUET_TYPES.get(field['type'], 'string'))())
+            for field in self.fields
+        ])
+        self.parquet = pq.ParquetWriter(self.filename, self.schema)
+        self.dropped = {}
+
+    def column_array(self, name, values, column_type):
+        if column_type == pa.string():
+            values = [value if value is None or isinstance(value, str) else json.dumps(value) for value in values]
+            return pa.array(values, type=column_type)
+        try:
+            return pa.array(values, type=column_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+            coerced = [coerce_value(value, column_type) for value in values]
+            dropped = sum(1 for value, fixed in zip(values, coerced) if value is not None and fixed is None)
+            if dropped:
+                self.dropped[name] = self.dropped.get(name, 0) + dropped
+            return pa.array(coerced, type=column_type)
+
+    def write_rows(self, rows):
+        columns = list(zip(*rows))
+        arrays = [
+            self.column_array(name, columns[i], column_type)
+            for i, (name, column_type) in enumerate(zip(self.schema.names, self.schema.types))
+        ]
+        self.parquet.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def finish(self):
+        self.parquet.close()
+        for name, dropped in sorted(self.dropped.items()):
+            print("{0}: {1} values of {2} didn't fit its {3} column and were written as null".format(
+                self.filename, dropped, name, self.schema.field(name).type))
+
+
+OUTPUT_FORMATS = ['csv', 'csv.gz', 'csv.zst', 'ndjson', 'ndjson.gz', 'ndjson.zst', 'parquet']
+# Sinks whose files stay readable when more rows are appended after a close
+APPENDABLE_FORMATS = [output_format for output_format in OUTPUT_FORMATS if output_format != 'parquet']
+
+
+def open_writer(filename, fields, flush_size=FLUSH_SIZE, output_format='csv', append=False):
+    if output_format == 'parquet':
+        return ParquetWriter(filename, fields, flush_size, append)
+    if output_format.startswith('ndjson'):
+        return NdjsonWriter(filename, fields, flush_size, output_format, append)
+    return CsvWriter(filename, fields, flush_size, output_format, append)
+
+
+def merge_parts(part_filenames, filename, output_format='csv'):
+    """Concatenates the parts into filename, written under a temp name and renamed once complete.
+
+    The parts are left in place, remove_parts deletes them once the merge is recorded.
+    """
+    if output_format == 'parquet':
+        print("Parquet slices are kept as separate files: {0}".format(", ".join(part_filenames)))
+        return False
+    tmp_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+    with open_text(tmp_filename, 'w', output_format) as merged:
+        for i, part_filename in enumerate(part_filenames):
+            with open_text(part_filename, 'r', output_format) as part:
+                if output_format.startswith('csv'):
+                    header = part.readline()
+                    if i == 0:
+                        merged.write(header)
+                for line in part:
+                    merged.write(line)
+    os.rename(tmp_filename, filename)
+    return True
+
+
+def remove_parts(part_filenames):
+    for part_filename in part_filenames:
+        if os.path.exists(part_filename):
+            os.remove(part_filename)
+
+
+class FastJSONSerializer(JSONSerializer):
+    """Decodes ES responses with orjson/ujson, the scroll pages are the bulk of the export's CPU time."""
+
+    def loads(self, s):
+        return fast_json.loads(s)
+
+
+_clients = {}
+_versions = {}
+
+
+def es_client():
+    """One keep-alive connection pool per process, shared by every day and slice that process exports."""
+    pid = os.getpid()
+    if pid not in _clients:
+        # with_retries is the only retry layer, the transport's own retries would multiply with it
+        options = dict(maxsize=ES_POOL_SIZE, timeout=ES_TIMEOUT, max_retries=0, retry_on_timeout=False)
+        if fast_json is not None:
+            options['serializer'] = FastJSONSerializer()
+        _clients[pid] = Elasticsearch(ES_HOSTS, **options)
+    return _clients[pid]
+
+
+def with_retries(request, *args, **kwargs):
+    # Exponential backoff on connection errors and 429/5xx responses, anything else fails right away
+    for attempt in range(SCROLL_RETRIES):
+        try:
+            return request(*args, **kwargs)
+        except TransportError as ex:
+            retryable = isinstance(ex, ESConnectionError) or ex.status_code in (429, 500, 502, 503, 504)
+            if not retryable or attempt == SCROLL_RETRIES - 1:
+                raise
+            delay = RETRY_BACKOFF * 2 ** attempt
+            print("Retrying in {0}s after: {1}".format(delay, ex))
+            time.sleep(delay)
+
+
+def es_major_version(es):
+    pid = os.getpid()
+    if pid not in _versions:
+        _versions[pid] = int(with_retries(es.info)['version']['number'].split('.')[0])
+    return _versions[pid]
+
+
+def clear_scroll(es, sid):
+    try:
+        es.clear_scroll(scroll_id=sid)
+    except TransportError as ex:
+        print("Failed to clear scroll {0}: {1}".format(sid, ex))
+
+
+def start_stage(target, *args):
+    errors = []
+
+    def run():
+        try:
+            target(*args)
+        except Exception as ex:
+            errors.append(ex)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread, errors
+
+
+def put_until_stopped(queue, item, stop):
+    # Bounded put that gives up once another stage failed, instead of blocking on a queue nobody reads
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def get_until_stopped(queue, stop):
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            pass
+    return None
+
+
+def new_stats():
+    return {
+        'rows': 0,
+        'pages': 0,
+        'bytes': 0,
+        'duration': 0.0,
+        'fetch_seconds': 0.0,
+        'transform_seconds': 0.0,
+        'write_seconds': 0.0,
+        'scroll_latencies': [],
+    }
+
+
+def merge_stats(total, stats):
+    for key, value in stats.items():
+        total[key] += value
+    return total
+
+
+def fetch_pages(es, scroll, total_hits, label, pages, stats, stop, first_page=None):
+    # Producer: prefetches the next scroll page while earlier ones are transformed and written
+    try:
+        # Without scan (ES 5+) the search response already holds the first page
+        if first_page:
+            stats['pages'] += 1
+            if not put_until_stopped(pages, first_page, stop):
+                return
+            total_hits -= len(first_page)
+        while (total_hits > 0):
+            print("scroll {0}: total_hits: {1}".format(label, total_hits))
+            started = time.time()
+            page = with_retries(es.scroll, scroll_id=scroll['id'], scroll='60m')
+            latency = time.time() - started
+            stats['fetch_seconds'] += latency
+            stats['scroll_latencies'].append(latency)
+            scroll['id'] = page['_scroll_id']
+            data = page['hits']['hits']
+            if not data:
+                break
+            stats['pages'] += 1
+            if not put_until_stopped(pages, data, stop):
+                return
+            print("length: {}".format(len(data)))
+            total_hits -= len(data)
+    finally:
+        put_until_stopped(pages, None, stop)
+
+
+def select_fields(fields, include_fields=None, exclude_fields=None, docvalue_fields=False):
+    selected = []
+    for field in fields:
+        if include_fields and field['name'] not in include_fields:
+            continue
+        if exclude_fields and field['name'] in exclude_fields:
+            continue
+        field = dict(field, docvalue=docvalue_fields and field['type'] in DOCVALUE_TYPES)
+        selected.append(field)
+    return selected
+
+
+def dig(source, path):
+    value = source
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def hits_to_rows(data, fields):
+    rows = []
+    for datumn in data:
+        row = []
         for field in fields:
-            rowData.append(field['name'])
-        data_csv.writerow(rowData)
+            if field.get('docvalue'):
+                row.append(datumn.get("fields", {}).get(field['name'], [None])[0])
+            else:
+                row.append(dig(datumn.get("_source", {}), field['name'].split('.')))
+        rows.append(row)
+    return rows
 
 
-def add_rows(rows, filename):
-    with open(filename, 'a') as csvfile:
-        data_csv = csv.writer(csvfile, delimiter=',', lineterminator='\n', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        data_csv.writerows(rows)
+def make_row_builder(fields):
+    """Compiles a function turning a page of hits into rows with one literal lookup per column."""
+    cells = []
+    for field in fields:
+        if field.get('docvalue'):
+            cells.append("fields.get({0!r}, NONE)[0]".format(field['name']))
+        elif '.' in field['name']:
+            cells.append("DIG(source, {0!r})".format(tuple(field['name'].split('.'))))
+        else:
+            cells.append("source.get({0!r})".format(field['name']))
+    code = (
+        "def build_rows(data):\n"
+        "    return [[{0}] for source, fields in ((hit.get('_source', EMPTY), hit.get('fields', EMPTY)) for hit in data)]\n"
+    ).format(", ".join(cells))
+    namespace = {'EMPTY': {}, 'NONE': [None], 'DIG': dig}
+    exec(code, namespace)
+    return namespace['build_rows']
 
 
-def scroll_timeframe(gte_timestamp, lte_timestamp):
-    es = Elasticsearch(ES_HOSTS)
+def project_fields(body, fields, es_version):
+    # Only ask for the exported columns: doc values for numeric/date fields, _source for the rest
+    source_fields = [field['name'] for field in fields if not field.get('docvalue')]
+    body["_source"] = source_fields or False
+    docvalue_fields = [field['name'] for field in fields if field.get('docvalue')]
+    if docvalue_fields:
+        # Same hit['fields'] response, the request key was renamed in ES 5
+        body["docvalue_fields" if es_version >= 5 else "fielddata_fields"] = docvalue_fields
+    return body
 
-    fields = get_fields(es)
+
+def scroll_body(gte_scroll_date_epoch, lte_scroll_date_epoch, fields, es_version):
+    body = {
+        "query": {
+            "range": {
+                TIME_FIELD: {
+                    "gte": gte_scroll_date_epoch,
+                    "lte": lte_scroll_date_epoch,
+                    "format": "epoch_millis"
+                }
+            }
+        }
+    }
+    if es_version >= 5:
+        # search_type=scan is gone in ES 5, sorting on _doc is its replacement
+        body["sort"] = ["_doc"]
+    return project_fields(body, fields, es_version)
+
+
+def transform_pages(fields, pages, row_batches, stats, stop):
+    try:
+        build_rows = make_row_builder(fields)
+        for data in iter(lambda: get_until_stopped(pages, stop), None):
+            started = time.time()
+            rows = build_rows(data)
+            stats['transform_seconds'] += time.time() - started
+            if not put_until_stopped(row_batches, rows, stop):
+                return
+    finally:
+        put_until_stopped(row_batches, None, stop)
+
+
+def export_fields(include_fields=None, exclude_fields=None, docvalue_fields=False, **_):
+    return select_fields(get_fields(es_client()), include_fields, exclude_fields, docvalue_fields)
+
+
+def day_fields(day_state, scroll_options):
+    """The day's columns, resolved once and kept in its checkpoint entry.
+
+    Every window and slice of the day is written with this list, so a mapping change while the
+    day is exported (or before it's resumed) can't give its parts different columns.
+    """
+    if not day_state.get('fields'):
+        day_state['fields'] = export_fields(**scroll_options)
+    return day_state['fields']
+
+
+def scroll_timeframe(gte_timestamp, lte_timestamp, full_filename=None, flush_size=FLUSH_SIZE, queue_size=QUEUE_SIZE,
+                     output_format='csv', include_fields=None, exclude_fields=None, docvalue_fields=False, stats=None,
+                     append=False, fields=None):
+    stats = new_stats() if stats is None else stats
+    started = time.time()
+    es = es_client()
+
+    if fields is None:
+        fields = export_fields(include_fields, exclude_fields, docvalue_fields)
 
     gte_scroll_date_epoch = dt_to_timestamp(gte_timestamp)
     lte_scroll_date_epoch = dt_to_timestamp(lte_timestamp)
 
     # Initialize the scroll
-    page = es.search(
+    es_version = es_major_version(es)
+    search_options = {'search_type': 'scan'} if es_version < 5 else {}
+    page = with_retries(
+        es.search,
         index=INDEX_NAME,
         scroll='60m',
-        search_type='scan',
         size=1000,
-        body={
-            "query": {
-                "range": {
-                    TIME_FIELD: {
-                        "gte": gte_scroll_date_epoch,
-                        "lte": lte_scroll_date_epoch,
-                        "format": "epoch_millis"
-                    }
-                }
-            }
-        }
+        body=scroll_body(gte_scroll_date_epoch, lte_scroll_date_epoch, fields, es_version),
+        **search_options
     )
-    sid = page['_scroll_id']
     total_hits = page['hits']['total']
+    label = gte_timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+    if full_filename is None:
+        full_filename = day_filename(gte_timestamp, output_format)
+
+    # Bounded queues between fetch -> transform -> write keep memory flat whatever the day's size
+    pages = Queue(maxsize=queue_size)
+    row_batches = Queue(maxsize=queue_size)
+    scroll = {'id': page['_scroll_id']}
+    # Set as soon as any stage stops, so the others never block on a queue that won't be drained
+    stop = threading.Event()
+    try:
+        writer = open_writer(full_filename, fields, flush_size, output_format, append)
+        try:
+            fetcher, fetch_errors = start_stage(fetch_pages, es, scroll, total_hits, label, pages, stats, stop,
+                                                 page['hits']['hits'])
+            transformer, transform_errors = start_stage(transform_pages, fields, pages, row_batches, stats, stop)
+            try:
+                for rows in iter(lambda: get_until_stopped(row_batches, stop), None):
+                    write_started = time.time()
+                    writer.add_rows(rows)
+                    stats['write_seconds'] += time.time() - write_started
+            finally:
+                stop.set()
+                fetcher.join()
+                transformer.join()
+        finally:
+            write_started = time.time()
+            writer.close()
+            stats['write_seconds'] += time.time() - write_started
+        for errors in (fetch_errors, transform_errors):
+            if errors:
+                raise errors[0]
+    finally:
+        # Don't leave the 60m scroll context open on the cluster, whether the export finished or failed
+        clear_scroll(es, scroll['id'])
+
+    stats['rows'] += writer.rows
+    stats['bytes'] += writer.bytes
+    stats['duration'] += time.time() - started
+    # A retried scroll request may have already moved the cursor on the server, skipping a page
+    if writer.rows != total_hits:
+        raise RuntimeError("Scroll {0} exported {1} rows but the search matched {2}".format(
+            label, writer.rows, total_hits))
+    print("Finished scroll {0}: {1} rows, {2:.0f} rows/sec, {3:.0f} bytes/sec".format(
+        label, writer.rows, writer.rows_per_sec(), writer.bytes_per_sec()))
+    return full_filename
+
+
+def scroll_part(args):
+    part, window_args, scroll_options = args
+    stats = new_stats()
+    scroll_timeframe(*window_args, stats=stats, **scroll_options)
+    return part, stats
 
-    full_filename = LOCAL_EXPORT_PATH + "/{0}_{1}.csv".format(INDEX_MAPPING_NAME, gte_timestamp.strftime('%Y-%m-%d'))
-    add_headers(fields, full_filename)
-
-    # Start scrolling
-    while (total_hits > 0):
-        print("scroll {0}: total_hits: {1}".format(gte_timestamp.strftime('%Y-%m-%d'), total_hits))
-        page = es.scroll(scroll_id=sid, scroll='60m')
-        sid = page['_scroll_id']
-        data = page['hits']['hits']
-        rows = []
-        for datumn in data:
-            row = []
-            for field in fields:
-                row.append(datumn["_source"].get(field['name']))
-            rows.append(row)
-        add_rows(rows, full_filename)
-        print("length: {}".format(len(data)))
-        total_hits -= len(data)
-    print("Finished scroll {0}:".format(gte_timestamp.strftime('%Y-%m-%d')))
-
-
-def export():
-    dateList = [datetime.now() - timedelta(days=1)]
 
+def load_checkpoint(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint, filename):
+    # Write-then-rename so a crash never leaves a truncated checkpoint behind
+    tmp_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+        json.dump(checkpoint, f, indent=2, sort_keys=True)
+    os.rename(tmp_filename, filename)
+
+
+def scroll_timeframe_parallel(pool, gte_timestamp, lte_timestamp, slices, merge=True,
+                              checkpoint=None, checkpoint_file=CHECKPOINT_FILE, **scroll_options):
+    output_format = scroll_options.get('output_format', 'csv')
+    day_key = gte_timestamp.strftime('%Y-%m-%d')
+    checkpoint = {} if checkpoint is None else checkpoint
+    day_state = checkpoint.get(day_key)
+    if not day_state or day_state.get('slices') != slices:
+        day_state = checkpoint[day_key] = {'slices': slices, 'parts': [], 'done': False}
+    part_options = dict(scroll_options, fields=day_fields(day_state, scroll_options))
+    save_checkpoint(checkpoint, checkpoint_file)
+
+    windows = split_timeframe(gte_timestamp, lte_timestamp, slices)
+    pending = [
+        (part, (window["gte"], window["lte"], part_filename(gte_timestamp, part, output_format)), part_options)
+        for part, window in enumerate(windows)
+        if part not in day_state['parts']
+    ]
+    if len(pending) < slices:
+        print("Resuming {0}: {1} of {2} slices already exported".format(day_key, slices - len(pending), slices))
+
+    stats = new_stats()
+    for part, part_stats in pool.imap_unordered(scroll_part, pending):
+        merge_stats(stats, part_stats)
+        day_state['parts'].append(part)
+        save_checkpoint(checkpoint, checkpoint_file)
+
+    if merge:
+        part_filenames = [part_filename(gte_timestamp, part, output_format) for part in range(slices)]
+        # Record the merge before deleting parts, a crash in between then just finishes the cleanup
+        if not day_state.get('merged'):
+            day_state['merged'] = merge_parts(part_filenames, day_filename(gte_timestamp, output_format), output_format)
+            save_checkpoint(checkpoint, checkpoint_file)
+        if day_state['merged']:
+            remove_parts(part_filenames)
+    day_state['done'] = True
+    save_checkpoint(checkpoint, checkpoint_file)
+    print("Finished parallel scroll {0}: {1} slices".format(day_key, slices))
+    return stats
+
+
+def scroll_timeframe_chunked(gte_timestamp, lte_timestamp, chunks=DAY_CHUNKS, checkpoint=None,
+                             checkpoint_file=CHECKPOINT_FILE, stats=None, **scroll_options):
+    """Scrolls the day window by window into one file, checkpointing the file size after each window.
+
+    On resume the file is truncated back to the last recorded offset, dropping a partly written
+    window, and the remaining windows are appended. Parquet can't be appended to, so a parquet
+    day is one window and starts over after a crash.
+    """
+    output_format = scroll_options.get('output_format', 'csv')
+    if output_format not in APPENDABLE_FORMATS:
+        chunks = 1
+    day_key = gte_timestamp.strftime('%Y-%m-%d')
+    filename = day_filename(gte_timestamp, output_format)
+    checkpoint = {} if checkpoint is None else checkpoint
+    day_state = checkpoint.get(day_key)
+    if (not day_state or day_state.get('chunks') != chunks
+            or (day_state['offset'] and not os.path.exists(filename))):
+        day_state = checkpoint[day_key] = {'chunks': chunks, 'parts': [], 'offset': 0, 'done': False}
+    fields = day_fields(day_state, scroll_options)
+    save_checkpoint(checkpoint, checkpoint_file)
+
+    if day_state['parts']:
+        print("Resuming {0}: {1} of {2} windows already exported".format(day_key, len(day_state['parts']), chunks))
+        with open(filename, 'r+b') as f:
+            f.truncate(day_state['offset'])
+
+    for chunk, window in enumerate(split_timeframe(gte_timestamp, lte_timestamp, chunks)):
+        if chunk in day_state['parts']:
+            continue
+        scroll_timeframe(window["gte"], window["lte"], filename, stats=stats, append=bool(day_state['parts']),
+                         fields=fields, **scroll_options)
+        day_state['parts'].append(chunk)
+        day_state['offset'] = os.path.getsize(filename)
+        save_checkpoint(checkpoint, checkpoint_file)
+
+    day_state['done'] = True
+    save_checkpoint(checkpoint, checkpoint_file)
+    return filename
+
+
+def tiebreak_field(es_version):
+    # Tie-breaker sort for search_after, unique per document: _id is only sortable from ES 6
+    return "_id" if es_version >= 6 else "_uid"
+
+
+def incremental_body(fields, state, page_size, gte_epoch, lte_epoch, es_version):
+    body = project_fields({
+        "size": page_size,
+        "sort": [{TIME_FIELD: "asc"}, {tiebreak_field(es_version): "asc"}],
+        "query": {"range": {TIME_FIELD: {"gte": gte_epoch, "lte": lte_epoch, "format": "epoch_millis"}}},
+    }, fields, es_version)
+    if state.get('search_after'):
+        body["query"]["range"][TIME_FIELD]["gte"] = state['search_after'][0]
+        body["search_after"] = state['search_after']
+    return body
+
+
+def export_incremental(state_file=INCREMENTAL_STATE_FILE, start_date=None, page_size=PAGE_SIZE, flush_size=FLUSH_SIZE,
+                       output_format='csv', include_fields=None, exclude_fields=None, docvalue_fields=False, stats=None,
+                       **_):
+    """Exports only documents past the last high-water mark (TIME_FIELD, tie-breaker) saved in state_file.
+
+    Each run stops at documents timestamped before it started. The first run, with no saved
+    mark, needs start_date as its lower bound rather than exporting the whole index into one file.
+    """
+    stats = new_stats() if stats is None else stats
+    started = time.time()
+    state = load_checkpoint(state_file)
+    if not state.get('search_after') and start_date is None:
+        raise ValueError("No high-water mark in {0}, pass --start_date for the first incremental run".format(state_file))
     create_directory(LOCAL_EXPORT_PATH)
+    es = es_client()
+    es_version = es_major_version(es)
+    if es_version < 5:
+        raise ValueError("Incremental export pages with search_after, which needs Elasticsearch 5 or later "
+                         "(server is {0}), use the daily scroll export instead".format(es_version))
+    fields = export_fields(include_fields, exclude_fields, docvalue_fields)
+    build_rows = make_row_builder(fields)
+    gte_epoch = dt_to_timestamp(start_date) if start_date else None
+    lte_epoch = str(int(started * 1000))
+    # Rows flushed to csv/ndjson (plain, gzip or zstd) are readable right away, a parquet file
+    # only once close() writes its footer, so its mark waits for the whole run
+    mark_per_page = output_format in APPENDABLE_FORMATS
+
+    full_filename = LOCAL_EXPORT_PATH + "/{0}_incremental_{1}.{2}".format(
+        INDEX_MAPPING_NAME, datetime.now().strftime('%Y-%m-%dT%H%M%S'), output_format)
+    with open_writer(full_filename, fields, flush_size, output_format) as writer:
+        while True:
+            search_started = time.time()
+            page = with_retries(es.search, index=INDEX_NAME,
+                                body=incremental_body(fields, state, page_size, gte_epoch, lte_epoch, es_version))
+            stats['scroll_latencies'].append(time.time() - search_started)
+            data = page['hits']['hits']
+            if not data:
+                break
+            stats['pages'] += 1
+            writer.add_rows(build_rows(data))
+            state['search_after'] = data[-1]['sort']
+            if mark_per_page:
+                # The mark only moves once its rows are on disk, a crash re-exports at most one page
+                writer.flush()
+                save_checkpoint(state, state_file)
+            print("incremental: {0} rows, high-water mark {1}".format(writer.rows, state['search_after']))
+    if not mark_per_page:
+        save_checkpoint(state, state_file)
+
+    stats['rows'] += writer.rows
+    stats['bytes'] += writer.bytes
+    stats['duration'] += time.time() - started
+    if writer.rows == 0:
+        os.remove(full_filename)
+        print("No documents newer than {0}".format(state.get('search_after')))
+        return None
+    print("Finished incremental export: {0} rows to {1}".format(writer.rows, full_filename))
+    return full_filename
+
+
+def days_between(start_date, end_date):
+    days = []
+    day = start_date
+    while day <= end_date:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def export(slices=1, workers=None, merge=True, start_date=None, end_date=None, checkpoint_file=CHECKPOINT_FILE,
+           restart=False, stats=None, day_durations=None, chunks=DAY_CHUNKS, **scroll_options):
+    stats = new_stats() if stats is None else stats
+    day_durations = {} if day_durations is None else day_durations
+    yesterday = datetime.now() - timedelta(days=1)
+    dateList = days_between(start_date or yesterday, end_date or start_date or yesterday)
+
+    create_directory(LOCAL_EXPORT_PATH)
+
+    checkpoint = {} if restart else load_checkpoint(checkpoint_file)
 
     scroll_dates = []
     for day in dateList:
+        if checkpoint.get(day.strftime('%Y-%m-%d'), {}).get('done'):
+            print("Skipping {0}: already exported".format(day.strftime('%Y-%m-%d')))
+            continue
         scroll_dates.append({"gte": datetime(day.year, day.month, day.day, 0, 0, 0), "lte": datetime(day.year, day.month, day.day, 23, 59, 59)})
-    for scroll_date in scroll_dates:
-        scroll_timeframe(scroll_date["gte"], scroll_date["lte"])
+
+    pool = Pool(workers or slices) if slices > 1 else None
+    try:
+        for scroll_date in scroll_dates:
+            day_key = scroll_date["gte"].strftime('%Y-%m-%d')
+            started = time.time()
+            if pool is None:
+                scroll_timeframe_chunked(scroll_date["gte"], scroll_date["lte"], chunks, checkpoint, checkpoint_file,
+                                         stats, **scroll_options)
+            else:
+                merge_stats(stats, scroll_timeframe_parallel(pool, scroll_date["gte"], scroll_date["lte"], slices, merge,
+                                                             checkpoint, checkpoint_file, **scroll_options))
+            day_durations[day_key] = time.time() - started
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return stats
+
+
+def last_success_timestamp(metrics_file):
+    if not os.path.exists(metrics_file):
+        return None
+    with open(metrics_file, 'r') as f:
+        for line in f:
+            if line.startswith('es_export_last_success_timestamp_seconds'):
+                return float(line.split()[-1])
+    return None
+
+
+def write_metrics(metrics_file, stats, day_durations, success):
+    """Writes the run's stats in the Prometheus text format for node-exporter's textfile collector."""
+    labels = 'index="{0}",mapping="{1}"'.format(INDEX_NAME, INDEX_MAPPING_NAME)
+    last_success = time.time() if success else last_success_timestamp(metrics_file)
+    lines = [
+        '# HELP es_export_success Whether the last export run finished without errors.',
+        '# TYPE es_export_success gauge',
+        'es_export_success{{{0}}} {1}'.format(labels, 1 if success else 0),
+        '# HELP es_export_rows Rows exported by the last run.',
+        '# TYPE es_export_rows gauge',
+        'es_export_rows{{{0}}} {1}'.format(labels, stats['rows']),
+        '# HELP es_export_pages Scroll pages fetched by the last run.',
+        '# TYPE es_export_pages gauge',
+        'es_export_pages{{{0}}} {1}'.format(labels, stats['pages']),
+        '# HELP es_export_bytes_written Bytes written to export files by the last run.',
+        '# TYPE es_export_bytes_written gauge',
+        'es_export_bytes_written{{{0}}} {1}'.format(labels, stats['bytes']),
+        '# HELP es_export_scroll_latency_seconds Latency of scroll/search requests in the last run.',
+        '# TYPE es_export_scroll_latency_seconds histogram',
+    ]
+    latencies = stats['scroll_latencies']
+    for bucket in SCROLL_LATENCY_BUCKETS:
+        lines.append('es_export_scroll_latency_seconds_bucket{{{0},le="{1}"}} {2}'.format(
+            labels, bucket, len([latency for latency in latencies if latency <= bucket])))
+    lines.extend([
+        'es_export_scroll_latency_seconds_bucket{{{0},le="+Inf"}} {1}'.format(labels, len(latencies)),
+        'es_export_scroll_latency_seconds_sum{{{0}}} {1}'.format(labels, sum(latencies)),
+        'es_export_scroll_latency_seconds_count{{{0}}} {1}'.format(labels, len(latencies)),
+        '# HELP es_export_day_duration_seconds Wall clock time spent exporting each day in the last run.',
+        '# TYPE es_export_day_duration_seconds gauge',
+    ])
+    for day_key, duration in sorted(day_durations.items()):
+        lines.append('es_export_day_duration_seconds{{{0},day="{1}"}} {2}'.format(labels, day_key, duration))
+    if last_success is not None:
+        lines.extend([
+            '# HELP es_export_last_success_timestamp_seconds Unix time of the last successful export run.',
+            '# TYPE es_export_last_success_timestamp_seconds gauge',
+            'es_export_last_success_timestamp_seconds{{{0}}} {1}'.format(labels, last_success),
+        ])
+
+    # Same write-then-move as the textfile collector scripts, node-exporter never reads a partial file
+    with open(metrics_file + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.rename(metrics_file + '.tmp', metrics_file)
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def parse_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
 
 if __name__ == '__main__':
-    export()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--start_date", type=parse_date,
+        help="First day to export as YYYY-MM-DD, also the lower bound of the first --incremental run (Default: yesterday)")
+    parser.add_argument(
+        "--end_date", type=parse_date,
+        help="Last day to export as YYYY-MM-DD, inclusive (Default: --start_date)")
+    parser.add_argument(
+        "--incremental", "-i", action="store_true",
+        help="Export only documents newer than the saved high-water mark using search_after (ES 5+)")
+    parser.add_argument(
+        "--state_file", default=INCREMENTAL_STATE_FILE,
+        help="High-water mark file for --incremental (Default: {0})".format(INCREMENTAL_STATE_FILE))
+    parser.add_argument(
+        "--slices", "-s", type=int, default=1,
+        help="Split each day into N time windows scrolled in parallel (Default: 1)")
+    parser.add_argument(
+        "--workers", "-w", type=int,
+        help="No. of worker processes for sliced scrolls (Default: --slices)")
+    parser.add_argument(
+        "--chunks", type=int, default=DAY_CHUNKS,
+        help="Without --slices, scroll each day in N consecutive windows that a resume can skip (Default: {0})".format(
+            DAY_CHUNKS))
+    parser.add_argument(
+        "--no_merge", action="store_true",
+        help="Keep one CSV per slice instead of merging them into the day's file")
+    parser.add_argument(
+        "--flush_size", type=int, default=FLUSH_SIZE,
+        help="No. of rows buffered before each write to the export file (Default: {0})".format(FLUSH_SIZE))
+    parser.add_argument(
+        "--queue_size", type=int, default=QUEUE_SIZE,
+        help="Max pages buffered between fetch, transform and write stages (Default: {0})".format(QUEUE_SIZE))
+    parser.add_argument(
+        "--checkpoint", default=CHECKPOINT_FILE,
+        help="File recording finished days and slices, used to resume (Default: {0})".format(CHECKPOINT_FILE))
+    parser.add_argument(
+        "--restart", action="store_true",
+        help="Ignore the checkpoint and export every day in the range again")
+    parser.add_argument(
+        "--format", "-f", choices=OUTPUT_FORMATS, default='csv',
+        help="Output format; .gz/.zst compress the stream, parquet writes one row group per flush (Default: csv)")
+    parser.add_argument(
+        "--include_fields", type=parse_list,
+        help="Comma separated fields to export, fetched via _source filtering (Default: all mapped fields)")
+    parser.add_argument(
+        "--exclude_fields", type=parse_list,
+        help="Comma separated fields to leave out of the export")
+    parser.add_argument(
+        "--docvalue_fields", action="store_true",
+        help="Read numeric and date fields from doc values instead of _source")
+    parser.add_argument(
+        "--metrics_file",
+        help="Write run metrics to this .prom file, eg: {0}/es_export.prom".format(TEXTFILE_COLLECTOR_PATH))
+    args = parser.parse_args()
+    scroll_options = dict(
+        flush_size=args.flush_size, queue_size=args.queue_size, output_format=args.format,
+        include_fields=args.include_fields, exclude_fields=args.exclude_fields, docvalue_fields=args.docvalue_fields)
+    stats = new_stats()
+    day_durations = {}
+    try:
+        if args.incremental:
+            export_incremental(args.state_file, args.start_date, stats=stats, **scroll_options)
+        else:
+            export(args.slices, args.workers, not args.no_merge, args.start_date, args.end_date, args.checkpoint, args.restart,
+                   stats, day_durations, args.chunks, **scroll_options)
+    except Exception:
+        if args.metrics_file:
+            write_metrics(args.metrics_file, stats, day_durations, success=False)
+        raise
+    if args.metrics_file:
+        write_metrics(args.metrics_file, stats, day_durations, success=True)